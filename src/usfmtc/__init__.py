@@ -13,17 +13,21 @@ from usfmtc.utils import readsrc, getSrcName
 from usfmtc.validating.usfmparser import parseusfm, UsfmParserBackend
 from usfmtc.validating.rngparser import NoParseError
 from usfmtc.extension import Extensions
-from usfmtc.xmlutils import ParentElement, prettyxml, writexml
+from usfmtc.xmlutils import ParentElement, RangeElement, prettyxml, writexml, marksources, XMLWriter
 from usfmtc.validating.usxparser import USXConverter
 from usfmtc.validating.usfmgrammar import UsfmGrammarParser
 from usfmtc.usxmodel import addesids, cleanup, canonicalise, reversify, \
                             iterusx, iterusxref, \
-                            regularise, clear_empties, addorncv
-from usfmtc.usxcursor import USXCursor
-from usfmtc.usjproc import usxtousj, usjtousx
+                            regularise, clear_empties, addorncv, normalise, \
+                            ethash, chapterhashes
+from usfmtc.usxcursor import USXCursor, TextIndex
+from usfmtc.usjproc import usxtousj, usjtousx, writeusj, usfmtousj, readusj, iterusj, USJWriter
 from usfmtc.usfmparser import USFMParser, Grammar
-from usfmtc.usfmgenerate import usx2usfm
+from usfmtc.usfmgenerate import usx2usfm, USFMWriter, iterels
+from usfmtc.usxdiff import diff, patch
 from usfmtc.reference import RefList
+from usfmtc.refset import RefSet
+from usfmtc.refscan import RefScanner
 import xml.etree.ElementTree as et
 
 version = "0.4.7"
@@ -95,6 +99,10 @@ def readFile(infpath, informat=None, gramfile=None, grammar=None, extfiles=None,
         usxdoc = USX.fromUsfm(infpath, grammar=grammar, altparser=altparser, strict=strict, keepparser=keepparser, **kw)
     return usxdoc
 
+def _writeview(outf, root):
+    writer = XMLWriter(outf)
+    for ev, el in iterels(root, ("start", "end")):
+        writer.event(ev, el)
 
 class USX:
     @classmethod
@@ -122,10 +130,13 @@ class USX:
         return cls(res, grammar)
 
     @classmethod
-    def fromUsfm(cls, src, grammar=None, altparser=False, elfactory=None, timeout=1e7, strict=False, keepparser=False, **kw):
+    def fromUsfm(cls, src, grammar=None, altparser=False, elfactory=None, timeout=1e7, strict=False, keepparser=False, canonical=False, keepsource=False, **kw):
         """ Parses USFM using UsfmGrammarParser grammar and creates USX object.
             Raise usfmtc.parser.NoParseError on error.
             elfactory must take parent and pos named parameters not as attributes
+            keepsource keeps the USFM so that outUsfm can copy unchanged
+            paragraphs from it. Each paragraph is checked against what was
+            read before it is copied, so any change to it is output.
         """
         readerr = None
         try:
@@ -145,17 +156,23 @@ class USX:
 
         if p and readerr is not None:
             p.errors.insert(0, (readerr,))
-        cleanup(xml)            # normalize space, de-escape chars, cell aligns, etc.
+        if canonical:           # cleanup and canonicalise in one pass
+            normalise(xml, canonical=True)
+        else:
+            cleanup(xml)        # normalize space, de-escape chars, cell aligns, etc.
         res = cls(xml, grammar, errors=p.errors if p else None)
         if keepparser:
             res.parser = p
+        if keepsource and p is not None:
+            marksources(xml, len(data))
+            res.source = data
+            res.sourceversion = xml.get("version", None)
         return res
 
     @classmethod
     def fromUsj(cls, src, elfactory=None, grammar=None, **kw):
-        data = readsrc(src, errors=kw.get("errors", "replace"))
-        djson = json.loads(data)
-        xml = usjtousx(djson, elfactory=elfactory)
+        """ Reads USJ incrementally and creates USX object to hold it """
+        xml = readusj(src, elfactory=elfactory, errors=kw.get("errors", "replace"))
         return cls(xml, grammar)
 
     def __init__(self, xml, grammar=None, errors=None):
@@ -164,6 +181,8 @@ class USX:
         if self.grammar is None:
             self.grammar = Grammar()
         self.errors = errors    # list of errors (description, sfmparser.Pos)
+        self.textindex = None   # see buildtextindex
+        self.source = None      # USFM text the elements' srcspans index, see fromUsfm
 
     def copy(self, deep=False):
         res = self.__class__(self.xml.copy(deep=deep), grammar=self.grammar)
@@ -190,16 +209,24 @@ class USX:
         """ Output pretty XML USX. If file is None returns string """
         if self.xml is None:
             return None
+        if isinstance(self.xml, RangeElement):
+            return self._outwrite(file, self.xml, fn=_writeview)  # prettyxml changes tails
         prettyxml(self.xml)
         return self._outwrite(file, self.xml, fn=writexml)
 
     def outUsfm(self, file=None, grammar=None, altparser=False, **kw):
-        """ Output USFM from USX object. grammar is et doc. If file is None returns string """
+        """ Output USFM from USX object. grammar is et doc. If file is None returns string.
+            If read with keepsource, paragraphs not changed since are copied
+            from the source, unless the output is to differ in version or
+            escaping. """
         if not altparser:
             if grammar is None:
                 grammar = self.grammar
             if 'book' not in kw:
                 kw['book'] = self.book
+            if self.source is not None and self.sourceversion == self.getroot().get("version", None) \
+                        and not any(kw.get(k, None) for k in ("version", "escapes", "forcevid", "notilde")):
+                kw.setdefault('source', self.source)
             return self._outwrite(file, self.xml, fn=usx2usfm, args={'grammar': grammar, **kw})
         parser = USXConverter(grammar.getroot(), **kw)
         res = parser.parse(self.xml)
@@ -208,14 +235,18 @@ class USX:
             return self._outwrite(file, dat)
         return False
 
-    def outUsj(self, file=None, ensure_ascii=False, **kw):
-        """ Output USJ from USX object. If file is None returns dict """
-        res = usxtousj(self.xml)
+    def outUsj(self, file=None, ensure_ascii=False, compact=False, **kw):
+        """ Output USJ from USX object. If file is None returns dict. The file
+            is written as the tree is walked. compact leaves out all whitespace. """
         if file is None:
-            return res
+            return usxtousj(self.xml)
         else:
-            dat = json.dumps(res, indent=2, ensure_ascii=ensure_ascii)
-            self._outwrite(file, dat)
+            self._outwrite(file, self.xml, fn=writeusj,
+                           args={'indent': None if compact else 2, 'ensure_ascii': ensure_ascii})
+
+    def _writable(self):
+        if isinstance(self.xml, RangeElement):
+            raise ValueError("A view from getrefs(view=True) is read only, use materialize() to change it")
 
     def getroot(self):
         """ Returns root XML element """
@@ -229,38 +260,61 @@ class USX:
             end = USXCursor.fromRef(r.last, self, atend=True, skiptest=skiptest)
             yield start, end, r
 
-    def getrefs(self, *refs, addintro=False, titles=True, skiptest=None, headers=True, chapters=True, vid=None):
+    def getrefs(self, *refs, addintro=False, titles=True, skiptest=None, headers=True, chapters=True, vid=None, view=False):
         """ Returns a doc containing paragraphs of the contents of each reference.
             skiptest is a fn to test whether text in the marker does not cause
             a word break. addintro includes material before chapter 1, including titles.
             titles includes material up to the first introductory material. headers includes
             any section headers occurring immediately before a reference. chapters
-            says whether to include preceding chapter at the start of a range if v 1. """
+            says whether to include preceding chapter at the start of a range if v 1.
+            view returns a read only doc that shares unchanged elements with this one,
+            for output without copying. Its methods that change it raise ValueError,
+            but changes to its elements change this doc too. Use materialize() to get
+            a doc that can be changed. """
         root = self.getroot()
-        res = root.__class__(root.tag, attrib=root.attrib)
+        res = (RangeElement if view else root.__class__)(root.tag, attrib=root.attrib)
         books = set()
         for i, (start, end, r) in enumerate(self._procrefs(*refs, skiptest=skiptest)):
             subdoc = start.copy_range(root, end, addintro=(addintro and r.first.book not in books),
                                       titles=titles and not i, headers=headers, vid=r.first,
-                                      chapters=chapters, grammar=self.grammar)
+                                      chapters=chapters, grammar=self.grammar, view=view)
             if len(subdoc):
                 for e in subdoc:
-                    e.parent = res
+                    if not view or isinstance(e, RangeElement):
+                        e.parent = res
                     res.append(e)
             books.add(r.first.book)
-        res.insert(0, root[0].copy(deep=True, parent=res))
+        res.insert(0, root[0] if view else root[0].copy(deep=True, parent=res))
         return self.__class__(res, grammar=self.grammar)
 
+    def materialize(self):
+        """ Returns a doc that may be changed from one returned by getrefs(view=True) """
+        if isinstance(self.xml, RangeElement):
+            return self.__class__(self.xml.materialize(), grammar=self.grammar)
+        return self
+
     def gettext(self, *refs, skiptest=None):
         """ Returns the text of each reference one per line. skiptest is a fn
             to test whether text in the marker does not cause a word break. """
         root = self.getroot()
+        if self.textindex is not None and not self.textindex.isvalid(root):
+            self.textindex = TextIndex(root)
         res = []
-        for (start, end, r) in self._procrefs(*refs, skiptest=skiptest):
-            text = start.copy_text(root, end)
-            res.append(text)
+        for r in refs:
+            if self.textindex is not None and (text := self.textindex.gettext(r)) is not None:
+                res.append(text)
+                continue
+            for (start, end, r) in self._procrefs(r, skiptest=skiptest):
+                res.append(start.copy_text(root, end))
         return "\n".join(res)
 
+    def buildtextindex(self):
+        """ Creates an index of the main text by verse, after which gettext of
+            whole verses, chapters and ranges of them is a string slice. The index
+            is rebuilt if the document has changed. Returns the TextIndex. """
+        self.textindex = TextIndex(self.getroot())
+        return self.textindex
+
     def iterusx(self, refs=False, **kw):
         """ Iterates the doc root yielding a node and whether we are in or after (isin) the node.
             If refs is True also yield a third value of a current reference. Once until is hit,
@@ -275,6 +329,7 @@ class USX:
     def reversify(self, srcvrs, tgtvrs, **kw):
         """ Change versification of this text from the srcvrs object to the
             tgtvrs object: e.g. Versification("eng.vrs") """
+        self._writable()
         if srcvrs is None:
             srcvrs, tgtvrs = tgtvrs, srcvrs
             rev = True
@@ -296,6 +351,7 @@ class USX:
 
         if outtype == "usx":
             if addesids:
+                self._writable()
                 self.addesids()
             self.outUsx(outfpath, **kw)
         elif outtype == "usj":
@@ -307,8 +363,73 @@ class USX:
                     version = "0.4.7"
             self.outUsfm(grammar=grammar, file=outfpath, outversion=version, altparser=altparser, **kw)
 
+    def saveAll(self, outputs, grammar=None, version=None, ensure_ascii=False, compact=False, **kw):
+        """ Saves the document in several formats at once. outputs maps each
+            file path (or file) to its format: usx, usj or usfm, or None to
+            infer it from the filename extension. All the files are written,
+            in buffered chunks, from one walk of the tree. The USX is pretty
+            printed without changing any tails, so each output is as saveAs
+            would give on its own. version, and any kw, are for the USFM. """
+        root = self.getroot()
+        if root is None:
+            return
+        todo = []
+        for outfpath, outtype in outputs.items():
+            if outtype is None and not hasattr(outfpath, "read"):
+                outroot, ext = os.path.splitext(outfpath)
+                outtype = _filetypes.get(ext.lower(), None)
+            if outtype in ("usx", "usj", "usfm", "usfm3.0"):
+                todo.append((outfpath, outtype))
+        # usx2usfm may change attributes, so the USFM writers see each event last
+        todo.sort(key=lambda x: x[1].startswith("usfm"))
+        if grammar is None:
+            grammar = self.grammar
+        kw.setdefault('book', self.book)
+        if self.source is not None and self.sourceversion == root.get("version", None) \
+                    and version is None and not any(kw.get(k, None) for k in ("escapes", "forcevid", "notilde")):
+            kw.setdefault('source', self.source)
+        writers = []
+        files = []
+        try:
+            for outfpath, outtype in todo:
+                if hasattr(outfpath, "read"):
+                    outf = outfpath
+                else:
+                    outf = open(outfpath, "w", encoding="utf-8")
+                    files.append(outf)
+                if outtype == "usx":
+                    writers.append(XMLWriter(outf))
+                elif outtype == "usj":
+                    writers.append(USJWriter(outf, indent=None if compact else 2, ensure_ascii=ensure_ascii))
+                else:
+                    writers.append(USFMWriter(outf, root, grammar=grammar,
+                            version=[3, 0] if version is None and outtype == "usfm3.0" else version, **kw))
+            events = [w.event for w in writers]
+            # the events of each top level element are collected from the one
+            # walk of the tree and then given to each writer in turn
+            batch = []
+            depth = 0
+            for ev, el in iterels(root, ("start", "end")):
+                batch.append((ev, el))
+                depth += 1 if ev == "start" else -1
+                if depth > 1:
+                    continue
+                for event in events:
+                    skip = None     # the element whose inside this writer skips
+                    for e in batch:
+                        if skip is not None:
+                            if skip is e[1]:
+                                skip = None
+                        elif event(*e):
+                            skip = e[1]
+                batch = []
+        finally:
+            for f in files:
+                f.close()
+
     def canonicalise(self, version=None):
         """ Canonicalises the text especially with regard to whitespace """
+        self._writable()
         canonicalise(self.getroot(), version=version)
         if version is not None:
             self.version = version
@@ -321,17 +442,20 @@ class USX:
                 - if ptx, then set refs to gen="1" and closed="false" on note char styles
                 - clear out empty char styles and par styles
         """
+        self._writable()
         regularise(self.getroot(), ptx=ptx, grammar=self.grammar)
         clear_empties(self.getroot(), ptx=ptx, grammar=self.grammar)
 
     def addesids(self):
         """ Add esids to USX object (eid, sids, vids) """
+        self._writable()
         addesids(self.xml)
 
     def addorncv(self):
         """ Adds CV info to node.pos throughout the doc """
         if getattr(self, "addorned", False):
             return
+        self._writable()
         self.bridges = addorncv(self.getroot(), grammar=self.grammar)
         self.addorned = True
 
@@ -340,6 +464,26 @@ class USX:
             dictionary of ids to nodes (e.g. "a.intro") """
         self.chapters, self.ids = addindexes(self.xml)
 
+    def contenthash(self):
+        """ Returns a hash of the normalised content (as compared by etCmp).
+            Cached on each element and recalculated only for changed parts. """
+        return ethash(self.getroot())
+
+    def chapterhashes(self):
+        """ Returns a dict of content hashes keyed by chapter number (0 for
+            the book introduction) """
+        return chapterhashes(self.getroot())
+
+    def changedchapters(self, other):
+        """ Returns a sorted list of chapter numbers whose content differs
+            from that of another USX object, including any only in one. """
+        if self.contenthash() == other.contenthash():
+            return []
+        mine = self.chapterhashes()
+        theirs = other.chapterhashes()
+        return sorted((k for k in set(mine) | set(theirs) if mine.get(k) != theirs.get(k)),
+                      key=lambda x: (isinstance(x, str), x))
+
     @property
     def version(self):
         res = self.getroot().get('version', None)
@@ -349,6 +493,7 @@ class USX:
 
     @version.setter
     def version(self, version):
+        self._writable()
         if isinstance(version, (list, tuple)):
             version = "0.4.7".join([str(x) for x in version])
         if version is not None:
@@ -363,6 +508,7 @@ class USX:
 
     @book.setter
     def book(self, code):
+        self._writable()
         bke = self.getroot().find(".//book")
         if bke is not None:
             bke.set('code', code)
@@ -388,6 +534,7 @@ def main(hookcli=None, hookusx=None):
     parser.add_argument("-V","--validate",action="store_true",default=False,help="Use validating parser for USFM")
     parser.add_argument("-C","--canonical",action="store_true",help="Do not canonicalise")
     parser.add_argument("-A","--ascii",action="store_true",help="Output as ASCII only in json")
+    parser.add_argument("--compact",action="store_true",help="Output json without whitespace")
     parser.add_argument("-l","--logging",help="Set logging level to usfmxtest.log")
     parser.add_argument("-q","--quiet",action="store_true",help="Don't say much")
     parser.add_argument("--nooutput",action="store_true",help="Don't output any data")
@@ -476,11 +623,29 @@ def main(hookcli=None, hookusx=None):
             outfile = sys.stdout
 
         usxdoc = None
+        # canonicalise USFM while parsing, if nothing is to happen in between
+        intype = args.informat or _filetypes.get(os.path.splitext(getattr(infile, "name", infile))[1].lower(), "")
+        fused = intype.startswith("usfm") and not args.canonical and reflist is None \
+                    and hookusx is None and args.version is None
         if not args.quiet:
             print(f"{infile} -> {outfile}" if outfile else f"{infile}")
+        # stream straight to USJ when the USX tree is not needed
+        if fused and args.outformat == "usj" and outfile is not None and not args.nooutput \
+                    and not args.esids and not args.validate:
+            outf = outfile if outfile is sys.stdout else open(outfile, "w", encoding="utf-8")
+            try:
+                errors = usfmtousj(outf, infile, grammar=ingrammar, canonical=True,
+                                   indent=None if args.compact else 2,
+                                   ensure_ascii=args.ascii, strict=args.strict)
+            finally:
+                if outf is not sys.stdout:
+                    outf.close()
+            for m, p, r in errors:
+                doerror(f"{r} ({p}): {m}", False)
+            continue
         try:
             usxdoc = readFile(infile, informat=args.informat, grammar=ingrammar,
-                              altparser=args.validate, strict=args.strict)
+                              altparser=args.validate, strict=args.strict, canonical=fused)
         except NoParseError as e:
             doerror(f"Failed to parse {infile}: {e}", False)
         except SyntaxError as e:
@@ -510,11 +675,12 @@ def main(hookcli=None, hookusx=None):
         elif usxdoc.version is None:
             usxdoc.version = [3, 1]
 
-        if not args.canonical:
+        if not args.canonical and not fused:
             usxdoc.canonicalise()
 
         usxdoc.saveAs(outfile, outformat=args.outformat, addesids=args.esids,
-                      grammar=outgrammar, altparser=args.validate, ensure_ascii=args.ascii)
+                      grammar=outgrammar, altparser=args.validate, ensure_ascii=args.ascii,
+                      compact=args.compact)
 
 if __name__ == "__main__":
     main()
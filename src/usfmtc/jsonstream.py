@@ -0,0 +1,188 @@
+
+from json.decoder import scanstring, JSONDecodeError
+import codecs, io, re
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+_rews = re.compile(r"[ \t\n\r]*")
+# the next token: punctuation, a string with no escapes, or anything else
+_retoken = re.compile(r'[ \t\n\r]*(?:([{}\[\],:])|"([^"\\\x00-\x1f]*)"|([^ \t\n\r]))')
+_PUNCT, _STRING, _OTHER = 1, 2, 3
+_renum = re.compile(r"-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?")
+_literals = {"true": True, "false": False, "null": None}
+_litevents = {"true": "boolean", "false": "boolean", "null": "null"}
+
+# what may come next
+_VALUE, _FIRSTVALUE, _KEY, _FIRSTKEY, _COLON, _AFTER = range(6)
+
+class JSONTokenizer:
+    ''' Incremental JSON tokenizer. Reads inf (anything with a read method,
+        returning str or utf-8 bytes) bufsize characters at a time and yields
+        (event, value) pairs as ijson.basic_parse does: start_map, map_key,
+        end_map, start_array, end_array, string, number, boolean and null.
+        Only the current token need be held in memory. Raises JSONDecodeError
+        on bad JSON. '''
+
+    def __init__(self, inf, bufsize=65536):
+        self.inf = inf
+        self.bufsize = bufsize
+        self.buf = ""
+        self.pos = 0
+        self.offset = 0         # of buf[0] in the input
+        self.eof = False
+        self.decoder = None
+
+    def _more(self):
+        ''' Reads the next chunk, dropping what has been consumed '''
+        chunk = self.inf.read(self.bufsize)
+        self.eof = not len(chunk)
+        if isinstance(chunk, bytes):
+            if self.decoder is None:
+                self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+            chunk = self.decoder.decode(chunk, final=self.eof)
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def _error(self, msg):
+        raise JSONDecodeError(f"{msg} at input offset {self.offset + self.pos}", self.buf, self.pos)
+
+    def _peek(self):
+        ''' Skips whitespace and returns the next character or "" at the end '''
+        while True:
+            self.pos = _rews.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._more()
+
+    def _string(self):
+        while True:
+            try:
+                res, self.pos = scanstring(self.buf, self.pos + 1)
+                return res
+            except JSONDecodeError:
+                if self.eof:
+                    self._error("Unterminated or bad string")
+                self._more()
+
+    def _scalar(self, c):
+        ''' Returns the (event, value) of the string, number or literal at pos '''
+        if c == '"':
+            return ("string", self._string())
+        while True:
+            m = _renum.match(self.buf, self.pos)
+            # a number or literal may run on into the next chunk
+            end = self.pos + 5 if m is None else m.end() + 2
+            if end < len(self.buf) or self.eof:
+                break
+            self._more()
+        if m is not None:
+            self.pos = m.end()
+            if m.group(1) or m.group(2):
+                return ("number", float(m.group(0)))
+            return ("number", int(m.group(0)))
+        for k, v in _literals.items():
+            if self.buf.startswith(k, self.pos):
+                self.pos += len(k)
+                return (_litevents[k], v)
+        self._error("Expecting value")
+
+    def __iter__(self):
+        stack = []
+        state = _VALUE
+        match = _retoken.match
+        while True:
+            m = match(self.buf, self.pos)
+            if m is None:           # at the end of the buffer
+                if self._peek() != "":
+                    continue
+                if state != _AFTER or len(stack):
+                    self._error("Expecting value")
+                return
+            kind = m.lastindex
+            c = m.group(kind)
+            if kind == _OTHER:      # leave it to _scalar or _string
+                self.pos = m.start(kind)
+            else:
+                self.pos = m.end()
+            if state == _AFTER:
+                if not len(stack):
+                    self._error("Extra data")
+                elif kind != _PUNCT:
+                    self._error("Expecting ',' delimiter")
+                elif c == ",":
+                    state = _KEY if stack[-1] == "{" else _VALUE
+                elif c == "}" and stack[-1] == "{":
+                    stack.pop()
+                    yield ("end_map", None)
+                elif c == "]" and stack[-1] == "[":
+                    stack.pop()
+                    yield ("end_array", None)
+                else:
+                    self._error("Expecting ',' delimiter")
+            elif state == _COLON:
+                if c != ":" or kind != _PUNCT:
+                    self._error("Expecting ':' delimiter")
+                state = _VALUE
+            elif state in (_KEY, _FIRSTKEY):
+                if kind == _STRING:
+                    state = _COLON
+                    yield ("map_key", c)
+                elif c == '"':
+                    state = _COLON
+                    yield ("map_key", self._string())
+                elif c == "}" and kind == _PUNCT and state == _FIRSTKEY:
+                    stack.pop()
+                    state = _AFTER
+                    yield ("end_map", None)
+                else:
+                    self._error("Expecting property name enclosed in double quotes")
+            elif kind == _STRING:
+                state = _AFTER
+                yield ("string", c)
+            elif kind == _OTHER:
+                res = self._scalar(c)
+                state = _AFTER
+                yield res
+            elif c == "{":
+                stack.append(c)
+                state = _FIRSTKEY
+                yield ("start_map", None)
+            elif c == "[":
+                stack.append(c)
+                state = _FIRSTVALUE
+                yield ("start_array", None)
+            elif c == "]" and state == _FIRSTVALUE:
+                stack.pop()
+                state = _AFTER
+                yield ("end_array", None)
+            else:
+                self._error("Expecting value")
+
+class _Utf8Reader:
+    ''' Reads a text file as utf-8 bytes '''
+    def __init__(self, inf):
+        self.inf = inf
+
+    def read(self, n=-1):
+        return self.inf.read(n).encode("utf-8")
+
+def _ijsonevents(inf, bufsize):
+    if isinstance(inf, io.TextIOBase):
+        inf = _Utf8Reader(inf)
+    try:
+        yield from ijson.basic_parse(inf, buf_size=bufsize, use_float=True)
+    except ijson.JSONError as e:
+        raise JSONDecodeError(str(e).split("\n")[0], "", 0) from e
+
+def iterjson(inf, bufsize=65536, pure=False):
+    ''' Yields the (event, value) pairs of the JSON read incrementally from inf,
+        using ijson if it is installed, unless pure. '''
+    if ijson is not None and not pure:
+        return _ijsonevents(inf, bufsize)
+    return iter(JSONTokenizer(inf, bufsize=bufsize))
@@ -4,7 +4,12 @@ from typing import Optional, List, Tuple
 from dataclasses import dataclass
 import re, json, os
 from functools import reduce
-from collections import UserList
+from collections import UserList, OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 _bookslist = """GEN|50 EXO|40 LEV|27 NUM|36 DEU|34 JOS|24 JDG|21 RUT|4 1SA|31
         2SA|24 1KI|22 2KI|25 1CH|29 2CH|36 EZR|10 NEH|13 EST|10 JOB|42 PSA|150
@@ -172,6 +177,9 @@ def asmarkers(s: str, t: str) -> List[_MarkerRef]:
 
 _bookre = re.compile(r"\A(?:[A-Z][A-Z0-9][A-Z0-9]|[0-9](?:[A-Z][A-Z]|[0-9][A-Z]|[A-Z][0-9]))$")
 
+_rewhite = re.compile(r"\s*")
+_rerangesep = re.compile("\\s*[\u200F\u200E]?-[\u200F\u200E]?\\s*")
+
 _regexes = {
     "book": r"""(?P<transid>(?:[a-z0-9_-]*[+])*)
                     (?P<book>\d?{id})
@@ -243,6 +251,14 @@ class Environment:
             raise SyntaxError(f"Illegal book name: {bk}")
         return bk
 
+    def findrefs(self, text):
+        """ Returns a list of RefMatch(start, end, refs) for each reference
+            to a book named in this environment in text """
+        if getattr(self, '_scanner', None) is None:
+            from usfmtc.refscan import RefScanner
+            self._scanner = RefScanner(self)
+        return self._scanner.findall(text)
+
     def copy(self, **kw):
         res = self.__class__()
         for a in self.__allfields__:
@@ -292,6 +308,7 @@ class BookNamesEnvironment(Environment):
 
     def addBookName(self, bkid, *strs):
         self.booknames[bkid] = strs
+        self._scanner = None
         self.bookstrings[bkid] = bkid
         bkstrs = {}
         for s in strs:
@@ -302,19 +319,109 @@ class BookNamesEnvironment(Environment):
                 self.bookstrings.update({k.lower():v for k,v in bkstrs.items() if v != ""})
 
 
+class ParseCache:
+    ''' A bounded least recently used cache of parsed reference strings.
+        It holds its own parse results and hands out copies of them. '''
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind, s, context, kw):
+        ''' Returns a cache key or None if the parse cannot be cached '''
+        if any(v is not None and not isinstance(v, (str, int, bool)) for v in kw.values()):
+            return None
+        ctxt = None if context is None else context.last.str(force=2)
+        return (kind, s, ctxt, tuple(sorted(kw.items())))
+
+    def get(self, key):
+        res = self.data.get(key, None)
+        if res is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.data.move_to_end(key)
+        return _copyparsed(res)
+
+    def put(self, key, val):
+        self.data[key] = _copyparsed(val)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self):
+        self.data.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.data), "maxsize": self.maxsize}
+
+_parsecache = None
+
+def enable_parsecache(maxsize=4096):
+    """ Turns on caching of parsed reference strings in Ref() and RefList(),
+        keeping up to maxsize results. Returns the ParseCache. """
+    global _parsecache
+    _parsecache = ParseCache(maxsize)
+    return _parsecache
+
+def disable_parsecache():
+    global _parsecache
+    _parsecache = None
+
+def parsecache_stats():
+    """ Returns a dict of hits, misses, size and maxsize or None if the cache is off """
+    return None if _parsecache is None else _parsecache.stats()
+
+def _copyparsed(r):
+    if isinstance(r, RefList):
+        res = RefList([_copyparsed(x) for x in r], strict=r.strict)
+    elif isinstance(r, RefRange):
+        res = object.__new__(r.__class__)
+        res.__dict__.update(r.__dict__)
+        res.first = _copyparsed(r.first)
+        res.last = _copyparsed(r.last)
+    else:
+        # copy without going through __new__ and __init__
+        res = object.__new__(r.__class__)
+        for a in Ref.__slots__:
+            if (v := getattr(r, a, res)) is not res:
+                setattr(res, a, v)
+        if r.mrkrs is not None:
+            res.mrkrs = [m.copy() for m in r.mrkrs]
+    return res
+
+
+class _Versification:
+    ''' Ref.versification: that of the reference if set, else that of the class '''
+    def __get__(self, obj, cls):
+        if obj is not None and (res := getattr(obj, '_vrs', None)) is not None:
+            return res
+        return cls._defvrs
+
+    def __set__(self, obj, val):
+        obj._vrs = val
+
+def _keyval(v, bits):
+    """ Maps a Ref field into a sort key field of the given width """
+    if v is None:
+        return 0
+    elif v < 0:
+        return (1 << bits) - 1
+    return min(v + 1, (1 << bits) - 2)
+
 class Ref:
-    product: Optional[str] = None
-    book: Optional[str] = None
-    chapter: Optional[int] = None
-    verse: Optional[int] = None
-    subverse: Optional[str] = None
-    word: Optional[int] = None
-    char: Optional[int] = None
-    mrkrs: Optional[List["_MarkerRef"]] = None
+    # product, book, chapter, verse, subverse, word, char, mrkrs default to None
+    __slots__ = ('product', 'book', 'chapter', 'verse', 'subverse', 'word', 'char', 'mrkrs',
+                 'strend', 'strict', 'env', '_vrs')
 
-    versification: Optional[List[List[int]]] = None
+    versification = _Versification()
+    _defvrs = None
     _rebook = re.compile(regexes["book"], flags=re.X|re.I)
     _rebooklax = re.compile(regexes["booklax"], flags=re.X|re.I)
+    _rebooklaxpos = re.compile(regexes["booklax"][1:], flags=re.X|re.I)     # without ^ for pos matching
     _recontext = re.compile(regexes["context"], flags=re.X)
     _parmlist = ('product', 'book', 'chapter', 'verse', 'subverse', 'word', 'char', 'mrkrs')
 
@@ -323,7 +430,20 @@ class Ref:
                     bookranges: bool = False, **kw):
         if string is None or not len(string) or start != -1:
             return super().__new__(cls)
-        res = RefList(string, context=context, bookranges=bookranges, **kw)
+        if _parsecache is not None:
+            key = _parsecache.key(cls, string, context, dict(kw, bookranges=bookranges))
+            if key is not None:
+                if (res := _parsecache.get(key)) is not None:
+                    return res
+                res = cls._parseone(string, context, bookranges, kw)
+                _parsecache.put(key, res)
+                return res
+        return cls._parseone(string, context, bookranges, kw)
+
+    @classmethod
+    def _parseone(cls, string, context, bookranges, kw):
+        res = RefList(strict=kw.get('strict', False))
+        res.parse(string, context, bookranges=bookranges, **kw)
         res.simplify(bookranges=bookranges)
         if len(res) == 0:
             raise SyntaxError(f"Empty reference: '{string}'")
@@ -350,14 +470,16 @@ class Ref:
         from usfmtc.versification import cached_versification
         if fname is None:
             fname = os.path.join(os.path.dirname(__file__), 'org.vrs')
-        cls.versification = "Loading"
-        cls.versification = cached_versification(fname)
-        return cls.versification
+        cls._defvrs = "Loading"
+        cls._defvrs = cached_versification(fname)
+        return cls._defvrs
 
     def __init__(self, s: Optional[str]=None,
                     context: Optional['Ref']=None, start:int=0, strict: bool=False, fullmatch: bool=False, **kw):
         if getattr(self, 'chapter', None) is not None or getattr(self, 'book', None) is not None:
             return
+        for a in self._parmlist:
+            setattr(self, a, None)
         self.strict = strict
         self.env = kw.get('env', None)
         if s is not None:
@@ -399,13 +521,18 @@ class Ref:
         if s is None or not len(s):
             return 
         p = {}
-        s = s.strip()
-        bookre = self._rebook if strict else self._rebooklax
-        if m := bookre.match(s[start:]):
+        # match in place between pos and endpos rather than stripping and slicing,
+        # so that parsing a long list of references stays linear
+        pos = _rewhite.match(s, start).end()
+        endpos = len(s)
+        while endpos > pos and s[endpos-1].isspace():
+            endpos -= 1
+        bookre = self._rebook if strict else self._rebooklaxpos
+        if m := bookre.match(s, pos, endpos):
             p['product'] = m.group('transid') or None
             p['book'] = self.parsebook(m.group('book'), strict=strict)
-        elif not (m:= self._recontext.match(s[start:])):
-            raise SyntaxError("Cannot parse reference '{}' ({})".format(s[start:], s))
+        elif not (m:= self._recontext.match(s, pos, endpos)):
+            raise SyntaxError("Cannot parse reference '{}' ({})".format(s[pos:endpos], s))
         gs = m.groupdict()
         p['chapter'] = intend(gs.get('chap', None))
         p['verse'] = intend(gs.get('verse1', gs.get('verse2', None)))
@@ -425,7 +552,7 @@ class Ref:
             if rep is not None:
                 p[rep] = p['chapter']
                 p['chapter'] = None 
-        self.strend = m.end(0) + start
+        self.strend = m.end(0)
         if p.get('mrkrs', None) == []:
             p['mrkrs'] = None
         if single and p.get('book', None) in oneChbooks and p['verse'] is None:
@@ -447,19 +574,32 @@ class Ref:
     def __repr__(self):
         return "Ref('"+self.str(force=2)+"')"
 
+    def _fields(self):
+        return (self.product, self.book, self.chapter, self.verse, self.subverse,
+                self.word, self.char, self.mrkrs)
+
     def __eq__(self, o):
         if not isinstance(o, Ref):
             return False
-        res = all(getattr(self, a) is None or getattr(o, a) is None or getattr(self, a) == getattr(o, a) for a in self._parmlist)
-        # res = all(getattr(self, a) == getattr(o, a) for a in self._parmlist)
+        res = all(a is None or b is None or a == b for a, b in zip(self._fields(), o._fields()))
         return res
 
     def identical(self, o):
         """ Tests to see if two references are identical """
         if not isinstance(o, Ref):
             return False
-        res = all(getattr(self, a) == getattr(o, a) for a in self._parmlist)
-        return res
+        return self._fields() == o._fields()
+
+    def sortkey(self):
+        """ Returns an integer that sorts references into canonical order. None
+            sorts before any value, since it is the whole of the containing
+            reference, and end (-1) after any value. """
+        s = self.subverse
+        res = (books.get(self.book, 200) << 10) | _keyval(self.chapter, 10)
+        res = (res << 10) | _keyval(self.verse, 10)
+        res = (res << 5) | (min(max(ord(s[0].lower()) - 96, 0), 31) if s else 0)
+        res = (res << 12) | _keyval(self.word, 12)
+        return (res << 12) | _keyval(self.char, 12)
 
     def __contains__(self, o):
         """ self is a point and is inside or equal to o """
@@ -524,7 +664,7 @@ class Ref:
         return self > o or self in o
 
     def __hash__(self):
-        return hash(tuple(getattr(self, a, "") for a in self._parmlist))
+        return hash(self._fields())
 
     def __iter__(self):
         return RefRangeIter(self)
@@ -718,6 +858,53 @@ class Ref:
                 r.chapter = 1
         return r
 
+    def _ordinals(self):
+        vrs = self.first.versification or Ref.loadversification()
+        return vrs.getordinals()
+
+    def ordinal(self):
+        """ Returns the global verse ordinal of the first verse of the reference
+            in its versification """
+        return self._ordinals().ordinal(self.first)
+
+    def ordinals(self):
+        """ Returns the range of verse ordinals covered by the reference """
+        ords = self._ordinals()
+        return range(ords.span(self.first)[0], ords.span(self.last)[1])
+
+    def numverses(self):
+        return len(self.ordinals())
+
+    def distance(self, other):
+        """ Returns the number of verses from the start of this reference to
+            the start of other """
+        return other.first.ordinal() - self.first.ordinal()
+
+    @classmethod
+    def _newverse(cls, book, chapter, verse, vrs=None):
+        """ Makes a plain verse reference, as cls(book=, chapter=, verse=), without
+            the cost of __init__ """
+        res = object.__new__(cls)
+        res.product = res.subverse = res.word = res.char = res.mrkrs = res.env = None
+        res.book = book
+        res.chapter = chapter
+        res.verse = verse
+        res.strict = False
+        res.strend = 0
+        if vrs is not None:
+            res._vrs = vrs
+        return res
+
+    @classmethod
+    def fromordinal(cls, o, vrs=None):
+        """ Returns the verse reference for a global verse ordinal """
+        if vrs is None:
+            vrs = cls.versification or cls.loadversification()
+        res = vrs.getordinals().ref(o, factory=cls)
+        if vrs is not cls._defvrs:
+            res.versification = vrs
+        return res
+
     def allchaps(self):
         return self
 
@@ -821,6 +1008,9 @@ class RefRange:
     def __hash__(self):
         return hash((self.first, self.last))
 
+    def sortkey(self):
+        return self.first.sortkey()
+
     def __contains__(self, r):
         """ Tests for entire containment of r inside self """
         return r.first >= self.first and r.last <= self.last
@@ -833,6 +1023,12 @@ class RefRange:
     def isvalid(self):
         return self.first.isvalid() and self.last.isvalid()
 
+    ordinal = Ref.ordinal
+    ordinals = Ref.ordinals
+    numverses = Ref.numverses
+    distance = Ref.distance
+    _ordinals = Ref._ordinals
+
     def __iter__(self):
         return RefRangeIter(self)
 
@@ -878,13 +1074,38 @@ class RefRange:
         return res
 
 
+def _isplainverse(r):
+    return r.chapter is not None and r.chapter > 0 and r.verse is not None and r.verse > 0 \
+            and r.product is None and not r.subverse and r.word is None and r.char is None and not r.mrkrs
+
 class RefRangeIter:
 
     def __init__(self, base):
         self.r = base.first.copy()
         self.last = base.last
+        self.ords = None
+        first = base.first
+        if _isplainverse(first) and _isplainverse(self.last) \
+                and first.versification is self.last.versification:
+            # step through verse ordinals rather than calling nextverse
+            try:
+                ords = first._ordinals()
+                self.o = ords.ordinal(first)
+                self.end = ords.ordinal(self.last)
+            except (ValueError, AttributeError):
+                return
+            if first.book != self.last.book:
+                i = ords.bookindex[first.book]
+                bks = [b for b in allbooks[books[first.book]:books[self.last.book]+1] if b in books]
+                if ords.order[i:i+len(bks)] != bks:
+                    return
+            self.ords = ords
+            self.factory = first.__class__
+            self.vrs = getattr(first, '_vrs', None)
 
     def __next__(self):
+        if self.ords is not None:
+            return self._nextordinal()
         if self.r is None:
             raise StopIteration
         res = self.r
@@ -894,11 +1115,26 @@ class RefRangeIter:
             self.r = self.r.nextverse()
         return res
 
+    def _nextordinal(self):
+        if self.r is not None:
+            res = self.r
+            self.r = None
+        elif self.o > self.end:
+            raise StopIteration
+        else:
+            ords = self.ords
+            bks, chaps, vss = ords._reverse()
+            res = self.factory._newverse(ords.order[bks[self.o]], int(chaps[self.o]),
+                                         int(vss[self.o]), self.vrs)
+        self.o += 1
+        return res
+
 
 class RefList(UserList):
     def __init__(self, content: Optional[str | List[Ref | RefRange]] = None,
                 context: Optional[Ref]=None, start: int=0, sep: Optional[str]=None, 
                 strict: bool=False, **kw):
+        self.strict = strict
         if issubclass(content.__class__, (list, tuple, RefList)):
             super().__init__(content)
         elif issubclass(content.__class__, (Ref, RefRange)):
@@ -906,8 +1142,15 @@ class RefList(UserList):
         else:
             super().__init__()
             if content is not None and len(content):        # assume it's a str
+                key = None
+                if _parsecache is not None:
+                    key = _parsecache.key(RefList, content, context, dict(kw, start=start, sep=sep, strict=strict))
+                    if key is not None and (res := _parsecache.get(key)) is not None:
+                        self.extend(res)
+                        return
                 self.parse(content, context, start=start, sep=sep, strict=strict, **kw)
-        self.strict = strict
+                if key is not None:
+                    _parsecache.put(key, self)
 
     def parse(self, s: str, context:Ref=None, start:int=0, sep:str=None, bookranges:bool=False, 
                             factory=Ref, rangefactory=RefRange, **kw):
@@ -921,7 +1164,7 @@ class RefList(UserList):
             if s[start] in sep:
                 start += 1
                 continue
-            if (m := re.match("\\s*[\u200F\u200E]?-[\u200F\u200E]?\\s*", s[start:])):
+            if (m := _rerangesep.match(s, start)):
                 rangesep = m.group(0).strip()
                 if not len(res) or issubclass(res[-1].__class__, RefRange): # or res[-1].chapter is None:
                     raise SyntaxError(f"Bad - in {s} ({s[start:]})")
@@ -942,6 +1185,22 @@ class RefList(UserList):
             start = r.strend
         self.extend(res)
 
+    @classmethod
+    def parse_many(cls, lines, context: Optional[Ref]=None, skiperrors: bool=False, **kw):
+        """ Parses each string in lines (any iterable, e.g. a file) into a RefList.
+            Lines are parsed independently relative to context. If skiperrors,
+            lines that fail to parse give None rather than raising. """
+        res = []
+        for l in lines:
+            l = l.rstrip("\r\n")
+            try:
+                res.append(cls(l, context=context, **kw))
+            except (SyntaxError, ValueError):
+                if not skiperrors:
+                    raise
+                res.append(None)
+        return res
+
     def __str__(self):
         return self.str()
 
@@ -966,6 +1225,85 @@ class RefList(UserList):
         raise AttributeError(f"Bad attribute {a} or missing references [{len(self)}]")
 
     def simplify(self, sort=True, bookranges=False):
+        """ Sorts and merges overlapping and adjacent references. bookranges
+            allows merging across books. Works on verse ordinals when all the
+            references are whole verses, chapters or books in one book. """
+        spans = self._ordinalspans()
+        if spans is None:
+            return self._simplifyrefs(sort=sort, bookranges=bookranges)
+        items = list(zip(spans, self.data))
+        if sort:
+            items.sort(key=lambda x: (x[0][0], -x[0][1]))
+        res = []
+        lastref = None
+        for (s, e), r in items:
+            if lastref is not None and ls <= s <= le:
+                if s < le and e <= le:
+                    continue        # already covered
+                if s < le or r.first.book == lastref.last.book \
+                        or (bookranges and _nextbook(lastref.last.book) == r.first.book):
+                    if isinstance(res[-1], RefRange):
+                        res[-1].last = r.last
+                    else:
+                        res[-1] = RefRange(lastref, r.last)
+                    lastref = r
+                    ls, le = s, e
+                    continue
+            res.append(r)
+            lastref = r
+            ls, le = s, e
+        self[:] = res
+        return self
+
+    def _ordinalspans(self):
+        """ Returns a list of [start, end) verse ordinals, one per reference,
+            or None if any reference cannot be simplified that way. """
+        vrs = Ref.versification or Ref.loadversification()
+        if not hasattr(vrs, 'getordinals'):     # still loading the versification
+            return None
+        ords = vrs.getordinals()
+        bookstarts = ords.bookstarts
+        vnums = vrs.vnums
+
+        def span(x):
+            if x.product is not None or x.subverse or x.word is not None or x.char is not None \
+                    or x.mrkrs or getattr(x, '_vrs', None) not in (None, vrs):
+                return None
+            base = bookstarts.get(x.book, None)
+            if base is None:
+                return None
+            vbk = vnums[x.book]
+            c = x.chapter
+            if c is None:
+                return (base, base + vbk[-1])
+            elif not 0 < c < len(vbk):
+                return None
+            v = x.verse
+            if v is None:
+                return (base + vbk[c-1], base + vbk[c])
+            elif not 0 < v <= vbk[c] - vbk[c-1]:
+                return None
+            return (base + vbk[c-1] + v - 1, base + vbk[c-1] + v)
+
+        res = []
+        for r in self.data:
+            if isinstance(r, Ref):
+                fs = span(r)
+                if fs is None:
+                    return None
+                res.append(fs)
+                continue
+            f, l = r.first, r.last
+            if f.book != l.book or (f.verse is None and f == l):
+                return None
+            fs = span(f)
+            ls = span(l)
+            if fs is None or ls is None:
+                return None
+            res.append((fs[0], ls[1]))
+        return res
+
+    def _simplifyrefs(self, sort=True, bookranges=False):
         res = []
         lastref = Ref()
         temp = []
@@ -1014,6 +1352,45 @@ class RefList(UserList):
         for r in self:
             yield from r
 
+    def _ordinals(self):
+        vrs = (self[0].first.versification if len(self) else None) \
+                    or Ref.versification or Ref.loadversification()
+        return vrs.getordinals()
+
+    def ordinals(self):
+        """ Returns an array (numpy if installed) of the ordinals of all the
+            verses in the list, in list order, in the versification of the
+            first reference. Partial verses count as their whole verse. """
+        ords = self._ordinals()
+        starts = []
+        ends = []
+        for r in self.data:
+            starts.append(ords.span(r.first)[0])
+            ends.append(ords.span(r.last)[1])
+        return ords.expand(starts, ends)
+
+    def allverses(self):
+        """ Yields a Ref for every verse in the list, made as needed """
+        ords = self._ordinals()
+        yield from ords.refs(self.ordinals())
+
+    def validmask(self):
+        """ Returns whether each reference is in the versification, checking
+            them all at once. Missing chapters and verses count as valid. """
+        ords = self._ordinals()
+        def cols(refs):
+            bookindex = ords.bookindex.get
+            bks = [bookindex(r.book, -1) for r in refs]
+            chaps = [1 if r.chapter is None or r.chapter < 0 else r.chapter for r in refs]
+            vss = [1 if r.chapter is None or r.verse is None or r.verse < 0 else r.verse for r in refs]
+            return bks, chaps, vss
+        data = self.data
+        firsts = ords.valid(*cols([r.first for r in data]))
+        lasts = ords.valid(*cols([r.last for r in data]))
+        if np is not None:
+            return firsts & lasts
+        return [a and b for a, b in zip(firsts, lasts)]
+
     def allchaps(self):
         for r in self:
             yield from r.allchaps()
@@ -1037,6 +1414,16 @@ class RefList(UserList):
             res.insert(-1, Ref(allbooks[i]))
         return res
 
+def _nextbook(bk):
+    """ The book after bk in the order used by Ref.nextverse """
+    i = books.get(bk, None)
+    if i is None:
+        return None
+    i += 1
+    while i < len(allbooks) and allbooks[i] not in books:
+        i += 1
+    return allbooks[i] if i < len(allbooks) else None
+
 class RefJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, (Ref, RefRange, RefList)):
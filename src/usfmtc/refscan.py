@@ -0,0 +1,109 @@
+
+from usfmtc.reference import Environment, RefList, allbooks
+from dataclasses import dataclass
+import re
+
+_cv = r"\d+(?:[:.]\d+[a-z]?)?"
+_rng = r"{0}(?:\s*[-\u2013]\s*{0})?".format(_cv)
+_retail = re.compile(r"\.?[ \t\u00A0]*(?P<refs>{0}(?:[ \t\u00A0]*[,;][ \t\u00A0]*{0})*)".format(_rng))
+
+@dataclass
+class RefMatch:
+    ''' A reference found in text: text[start:end] parses to refs '''
+    start: int
+    end: int
+    refs: RefList
+
+class RefScanner:
+    ''' Finds scripture references in free text, such as footnotes or \\xt
+        content, in a single pass. The book names of a BookNamesEnvironment
+        (and the book codes if codes) are compiled into an Aho-Corasick
+        automaton. A book name only counts when it is a whole word followed
+        by a chapter number. Names match in any case, but a bare book code
+        only in upper case, so that words such as "man 3" are not taken as
+        references. '''
+
+    def __init__(self, env=None, codes=True):
+        if env is None:
+            env = Environment()
+        self.env = env
+        names = {}
+        for bk, strs in getattr(env, "booknames", {}).items():
+            for s in strs:
+                if s is None or not len(s.strip()):
+                    continue
+                s = s.strip().lower()
+                names[s] = (bk, None) if names.get(s, (bk, None))[0] == bk else (None, None)     # ambiguous names are dropped
+        if codes:
+            for bk in (getattr(env, "booknames", None) or allbooks):
+                names.setdefault(bk.lower(), (bk, bk))
+        self._build({k: v for k, v in names.items() if v[0] is not None})
+
+    def _build(self, names):
+        ''' Creates the trie of names and adds the failure links. names maps
+            each lower cased name to its (book, exact), where exact is the
+            text a code must match or None. outs[n] lists the (length, book,
+            exact) of each name that ends at node n, longest first. '''
+        self.goto = [{}]
+        self.fail = [0]
+        self.outs = [[]]
+        for s, (bk, exact) in names.items():
+            n = 0
+            for c in s:
+                nxt = self.goto[n].get(c, None)
+                if nxt is None:
+                    nxt = self.goto[n][c] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outs.append([])
+                n = nxt
+            self.outs[n].append((len(s), bk, exact))
+        queue = list(self.goto[0].values())
+        for n in queue:     # breadth first, so fail targets are already complete
+            for c, nxt in self.goto[n].items():
+                f = self.fail[n]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(c, 0)
+                self.outs[nxt] = self.outs[nxt] + self.outs[self.fail[nxt]]
+                queue.append(nxt)
+
+    def _candidates(self, text):
+        ''' Yields (start, end, book) of whole word book names in text '''
+        goto = self.goto
+        fail = self.fail
+        n = 0
+        for i, c in enumerate(text):
+            lc = c.lower()
+            if len(lc) == 1:
+                c = lc
+            while n and c not in goto[n]:
+                n = fail[n]
+            n = goto[n].get(c, 0)
+            if not self.outs[n] or (i + 1 < len(text) and text[i+1].isalpha()):
+                continue
+            for l, bk, exact in self.outs[n]:
+                s = i + 1 - l
+                if exact is not None and text[s:i+1] != exact:
+                    continue
+                if s == 0 or not text[s-1].isalnum():
+                    yield (s, i + 1, bk)
+                    break
+
+    def finditer(self, text):
+        ''' Yields a RefMatch for each reference in text, in order '''
+        lastend = 0
+        for s, e, bk in self._candidates(text):
+            if s < lastend or not (m := _retail.match(text, e)):
+                continue
+            refstr = "{} {}".format(bk, m.group('refs').replace("\u2013", "-"))
+            try:
+                refs = RefList(refstr)
+            except (SyntaxError, ValueError):
+                continue
+            lastend = m.end()
+            yield RefMatch(s, lastend, refs)
+
+    def findall(self, text):
+        ''' Returns a list of the RefMatches in text '''
+        return list(self.finditer(text))
@@ -0,0 +1,192 @@
+
+from usfmtc.reference import Ref, RefRange, RefList
+from bisect import bisect_right
+import operator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def _getordinals(vrs):
+    if vrs is None:
+        vrs = Ref.versification or Ref.loadversification()
+    return vrs.getordinals()
+
+def _normalise(starts, ends):
+    ''' Sorts and merges overlapping and adjacent intervals '''
+    if np is not None:
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if not len(starts):
+            return starts, ends
+        order = np.argsort(starts, kind="stable")
+        starts = starts[order]
+        ends = np.maximum.accumulate(ends[order])
+        # a new interval starts where it is beyond all the ends before it
+        isnew = np.empty(len(starts), dtype=bool)
+        isnew[0] = True
+        isnew[1:] = starts[1:] > ends[:-1]
+        newi = np.flatnonzero(isnew)
+        return starts[newi], ends[np.append(newi[1:] - 1, len(ends) - 1)]
+    rs = []
+    rends = []
+    for s, e in sorted(zip(starts, ends)):
+        if len(rends) and s <= rends[-1]:
+            if e > rends[-1]:
+                rends[-1] = e
+        else:
+            rs.append(s)
+            rends.append(e)
+    return rs, rends
+
+def _covered(starts, ends, pts):
+    ''' Returns whether each point is inside one of the intervals '''
+    if np is not None:
+        i = np.searchsorted(starts, pts, side="right") - 1
+        return (i >= 0) & (ends[np.maximum(i, 0)] > pts) if len(starts) else np.zeros(len(pts), dtype=bool)
+    res = []
+    for p in pts:
+        i = bisect_right(starts, p) - 1
+        res.append(i >= 0 and ends[i] > p)
+    return res
+
+def _combine(a, b, op):
+    ''' Sweeps the boundaries of two RefSets keeping the segments for which
+        op(in a, in b) is true '''
+    if np is not None:
+        pts = np.unique(np.concatenate((a.starts, a.ends, b.starts, b.ends)))
+        if len(pts) < 2:
+            return pts[:0], pts[:0]
+        keep = op(_covered(a.starts, a.ends, pts[:-1]), _covered(b.starts, b.ends, pts[:-1]))
+        prev = np.concatenate(([False], keep[:-1]))
+        nxt = np.concatenate((keep[1:], [False]))
+        return pts[:-1][keep & ~prev], pts[1:][keep & ~nxt]
+    pts = sorted(set(a.starts) | set(a.ends) | set(b.starts) | set(b.ends))
+    ina = _covered(a.starts, a.ends, pts[:-1])
+    inb = _covered(b.starts, b.ends, pts[:-1])
+    rs = []
+    rends = []
+    for i, (x, y) in enumerate(zip(ina, inb)):
+        if not op(x, y):
+            continue
+        if len(rends) and rends[-1] == pts[i]:
+            rends[-1] = pts[i+1]
+        else:
+            rs.append(pts[i])
+            rends.append(pts[i+1])
+    return rs, rends
+
+
+class RefSet:
+    ''' A set of verses held as sorted, disjoint [start, end) ranges of verse
+        ordinals in a versification. Subverses, words and characters are
+        widened to their verse. Uses numpy arrays when numpy is installed. '''
+
+    def __init__(self, refs=None, vrs=None):
+        self.ords = _getordinals(vrs)
+        self.vrs = self.ords.vrs
+        if refs is None:
+            refs = []
+        elif isinstance(refs, str):
+            refs = RefList(refs)
+        elif isinstance(refs, (Ref, RefRange)):
+            refs = [refs]
+        starts = []
+        ends = []
+        for r in refs:
+            # ordinals run on across books, so ranges of books need no splitting
+            starts.append(self.ords.span(r.first)[0])
+            ends.append(self.ords.span(r.last)[1])
+        self.starts, self.ends = _normalise(starts, ends)
+
+    @classmethod
+    def fromRefList(cls, refs, vrs=None):
+        return cls(refs, vrs=vrs)
+
+    @classmethod
+    def _fromarrays(cls, starts, ends, ords):
+        res = cls.__new__(cls)
+        res.ords = ords
+        res.vrs = ords.vrs
+        res.starts = starts
+        res.ends = ends
+        return res
+
+    def toRefList(self):
+        ''' Returns a RefList of a Ref or RefRange for each range of verses '''
+        res = RefList()
+        for s, e in zip(self.starts, self.ends):
+            first = self.ords.ref(int(s))
+            if e - s == 1:
+                res.append(first)
+            else:
+                res.append(RefRange(first, self.ords.ref(int(e) - 1)))
+        return res
+
+    def _other(self, other):
+        if not isinstance(other, RefSet):
+            other = self.__class__(other, vrs=self.vrs)
+        elif other.vrs is not self.vrs:
+            raise ValueError("RefSets have different versifications")
+        return other
+
+    def _combined(self, other, op):
+        other = self._other(other)
+        return self._fromarrays(*_combine(self, other, op), self.ords)
+
+    def union(self, other):
+        return self._combined(other, operator.or_)
+
+    def intersection(self, other):
+        return self._combined(other, operator.and_)
+
+    def difference(self, other):
+        return self._combined(other, lambda a, b: a & (b ^ True))
+
+    def symmetric_difference(self, other):
+        return self._combined(other, operator.xor)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+    def contains(self, refs):
+        ''' Are all the verses in refs (a Ref, RefRange, RefList or RefSet) in this set '''
+        other = self._other(refs)
+        return not len(other.difference(self).starts)
+
+    __contains__ = contains
+
+    def overlaps(self, refs):
+        ''' Are any of the verses in refs in this set '''
+        other = self._other(refs)
+        return len(self.intersection(other).starts) > 0
+
+    def __len__(self):
+        ''' The number of verses in the set '''
+        if np is not None:
+            return int((self.ends - self.starts).sum())
+        return sum(e - s for s, e in zip(self.starts, self.ends))
+
+    def __bool__(self):
+        return len(self.starts) > 0
+
+    def __eq__(self, other):
+        if not isinstance(other, RefSet):
+            return False
+        return other.vrs is self.vrs and list(self.starts) == list(other.starts) \
+                    and list(self.ends) == list(other.ends)
+
+    def __iter__(self):
+        ''' Yields the Ref of each verse in the set '''
+        for s, e in zip(self.starts, self.ends):
+            for o in range(int(s), int(e)):
+                yield self.ords.ref(o)
+
+    def __str__(self):
+        return str(self.toRefList())
+
+    def __repr__(self):
+        return f"RefSet('{self}')"
@@ -2,6 +2,7 @@
 import re
 from usfmtc.reference import Ref
 from usfmtc.usfmparser import WS
+from usfmtc.xmlutils import sourcespan
 
 def usvout(m):
     u = ord(m.group(1))
@@ -12,13 +13,32 @@ def usvout(m):
 
 _reesc = re.compile(r'([\\|~]|//)')
 _reatt = re.compile(r'([\\|"])')
+# what escaped() and attribescaped() change, so that most text can be passed straight through
+_retext = re.compile(r'[\\|~\u00A0]|//')
+_retextnotilde = re.compile(r'[\\|~]|//')
+_esctext = str.maketrans({"\\": "\\\\", "|": "\\|", "~": "\\~", "\u00A0": "~"})
+_esctextnotilde = str.maketrans({"\\": "\\\\", "|": "\\|", "~": "\\~"})
+_escatt = str.maketrans({"\\": "\\\\", "|": "\\|", '"': '\\"'})
+_renl = re.compile(r"\s*\n\s*")
+
 def attribescaped(s, escapes):
-    return escaped(s, escapes, reg=_reatt, notilde=True)
+    if _reatt.search(s) is not None:
+        s = s.translate(_escatt)
+    if escapes:
+        s = re.sub(r'([{}])'.format(escapes), usvout, s)
+    return s
 
 def escaped(s, escapes, reg=None, notilde=False):
-    res = (reg or _reesc).sub(r'\\\1', s)
-    if not notilde:
-        res = res.replace("\u00A0", "~")
+    if reg is not None:
+        res = reg.sub(r'\\\1', s)
+        if not notilde:
+            res = res.replace("\u00A0", "~")
+    elif (_retextnotilde if notilde else _retext).search(s) is None:
+        res = s
+    else:
+        res = s.translate(_esctextnotilde if notilde else _esctext)
+        if "//" in res:
+            res = res.replace("//", "\\//")
     if escapes:
         res = re.sub(r'([{}])'.format(escapes), usvout, res)
     return res
@@ -66,18 +86,37 @@ def get(el, k):
     return el.get(k, "")
 
 class Emitter:
-    def __init__(self, outf, escapes, notilde=False):
+    """ Collects the output in a list and writes it to outf whenever bufsize
+        characters have built up, and on flush() """
+    def __init__(self, outf, escapes, notilde=False, bufsize=65536):
         self.outf = outf
         self.escapes = escapes
         self.notilde = notilde
+        self.bufsize = bufsize
+        self.buf = []
+        self.size = 0
 
     def __call__(self, s, text=False):
         if s is None:
             return
-        s = re.sub(r"\s*\n\s*", "\n", s)
+        if "\n" in s:
+            s = _renl.sub("\n", s)
         if text:
             s = escaped(s, self.escapes, notilde=self.notilde)
-        self.outf.write(s)
+        self.raw(s)
+
+    def raw(self, s):
+        """ Outputs s as it is """
+        self.buf.append(s)
+        self.size += len(s)
+        if self.size >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        if len(self.buf):
+            self.outf.write("".join(self.buf))
+            self.buf = []
+            self.size = 0
 
     def tag(self, e, sep=" "):
         s = e.get('style', '')
@@ -86,13 +125,28 @@ class Emitter:
                 s = "{}-{}".format(s, e.get('colspan'))
             self("\\{0}{1}".format(s, sep))
 
-def iterels(el, events):
-    if 'start' in events:
+def iterels(el, events, skip=None):
+    """ Yields (event, element) for el and its descendants in document order.
+        An element that the caller appends to skip, when given its start,
+        is not descended into and has no end event. """
+    dostart = 'start' in events
+    doend = 'end' in events
+    if dostart:
         yield ('start', el)
-    for c in el:
-        yield from iterels(c, events)
-    if 'end' in events:
-        yield ('end', el)
+    stack = [(el, iter(el))]
+    while len(stack):
+        c = next(stack[-1][1], None)
+        if c is None:
+            e = stack.pop()[0]
+            if doend:
+                yield ('end', e)
+            continue
+        if dostart:
+            yield ('start', c)
+            if skip and skip[-1] is c:
+                skip.pop()
+                continue
+        stack.append((c, iter(c)))
 
 def _isnextref(cref, ref, e):
     if ref.chapter == cref.chapter:
@@ -102,157 +156,234 @@ def _isnextref(cref, ref, e):
     else:
         return ref.chapter == cref.chapter + 1 and ref.verse == 1
 
-def usx2usfm(outf, root, grammar=None, lastel=None, version=None, escapes="", forcevid=False, cref=None, book=None, **kw):
-    if grammar is None:
-        attribmap = {}
-        mcats = {}
+def _chaptercref(el, cref, book):
+    n = int(el.get("number", 0))
+    if cref is None:
+        cref = Ref(book=book, chapter=n, verse=0)
     else:
-        attribmap = grammar.attribmap
-        mcats = grammar.marker_categories
-    if version is None:
-        vtext = root.get("version")
-        if vtext:
-            version = [int(x) for x in vtext.split(".")]
-    if version is None:
-        version = [100]
-    if version < [3, 2]:
-        escapes = ""
-    emit = kw.get('emitter', Emitter)(outf, escapes, notilde=kw.get('notilde', False))
-    paraelements = ("chapter", "para", "row", "sidebar")
-    innote = None
-    for (ev, el) in iterels(root, ("start", "end")):
-        s = el.get("style", "")
+        cref.chapter = n
+        cref.verse = 0
+    return cref
 
-        if ev == "start":
-            if el.tag in paraelements and s != "":
-                if lastel is not None and lastel.tail is not None:
-                    emit(lastel.tail.rstrip(WS), text=True)
-                # emit("\n")
-            elif el.tag == "table":
-                if lastel is not None and lastel.tail is not None:
-                    emit(lastel.tail.rstrip(WS), text=True)
-            elif lastel is not None:
-                emit(lastel.tail, text=True)
-            lastel = None
-            prespace = False
-            if el.tag == "book":
-                book = el.get("code", None)
-            if el.tag == "chapter":
-                proc_start_ms(el, "chapter", "c", emit, "", escapes, version)
-                n = int(el.get("number", 0))
-                if cref is None:
-                    cref = Ref(book=book, chapter=n, verse=0)
-                else:
-                    cref.chapter = n
-                    cref.verse = 0
-            elif el.tag == "verse":
-                proc_start_ms(el, "verse", "v", emit, " ", escapes, version)
-                v = el.get("number", "0")
-                if cref is not None:
-                    try:
-                        cref = Ref(f"{cref.book or ''} {cref.chapter or 0}:{v}")
-                    except SyntaxError:
-                        cref = None
-                if cref is None:
-                    m = re.match(r"^(\d+)(.*?)$", v)
-                    if m:
-                        cref = Ref(book=book, chapter=0, verse=int(m.group(1)), subverse=m.group(2) or None)
+def _versecref(el, cref, book):
+    v = el.get("number", "0")
+    if cref is not None and v.isdecimal() and v.isascii():
+        # a plain verse number needs no reference parsing
+        return Ref._newverse(cref.book, cref.chapter or 0, int(v))
+    elif cref is not None:
+        try:
+            cref = Ref(f"{cref.book or ''} {cref.chapter or 0}:{v}")
+        except SyntaxError:
+            cref = None
+    if cref is None:
+        m = re.match(r"^(\d+)(.*?)$", v)
+        if m:
+            cref = Ref(book=book, chapter=0, verse=int(m.group(1)), subverse=m.group(2) or None)
+        else:
+            cref = Ref()
+    return cref
+
+def _sourcestate(el, cref, book):
+    """ Returns the (cref, book) that usx2usfm would have after outputting el """
+    for e in el.iter():
+        if e.tag == "book":
+            book = e.get("code", None)
+        elif e.tag == "chapter":
+            cref = _chaptercref(e, cref, book)
+        elif e.tag == "verse":
+            cref = _versecref(e, cref, book)
+        elif e.tag in ("row", "para") and 'vid' in e.attrib:
+            cref = Ref(e.get("vid", "")).last
+    return cref, book
+
+class USFMWriter:
+    """ Writes root as USFM to outf, as usx2usfm does, from the (event, element)
+        pairs of a walk of it given to event(), from the start of root to its
+        end. event() returns True for the start of an element that is copied
+        from source, so its descendants and its end need not be given. After
+        the end of root, lastel and cref are those usx2usfm returns. """
+    def __init__(self, outf, root, grammar=None, lastel=None, version=None, escapes="", forcevid=False, cref=None, book=None, source=None, **kw):
+        self.lastel = lastel
+        self.cref = cref
+        self.gen = self._events(outf, root, grammar, lastel, version, escapes, forcevid, cref, book, source, kw)
+        next(self.gen)
+
+    def event(self, ev, el):
+        if self.gen is None:
+            return True
+        try:
+            return self.gen.send((ev, el))
+        except StopIteration as e:
+            self.lastel, self.cref = e.value
+            self.gen = None
+
+    def _events(self, outf, root, grammar, lastel, version, escapes, forcevid, cref, book, source, kw):
+        if grammar is None:
+            attribmap = {}
+            mcats = {}
+        else:
+            attribmap = grammar.attribmap
+            mcats = grammar.marker_categories
+        if version is None:
+            vtext = root.get("version")
+            if vtext:
+                version = [int(x) for x in vtext.split(".")]
+        if version is None:
+            version = [100]
+        if version < [3, 2]:
+            escapes = ""
+        emit = kw.get('emitter', Emitter)(outf, escapes, notilde=kw.get('notilde', False))
+        flush = getattr(emit, "flush", lambda: None)
+        if not hasattr(emit, "raw"):
+            source = None
+        paraelements = ("chapter", "para", "row", "sidebar")
+        innote = None
+        res = None
+        while True:
+            ev, el = yield res
+            res = None
+            s = el.get("style", "")
+
+            if ev == "start":
+                if el.tag in paraelements and s != "":
+                    if lastel is not None and lastel.tail is not None:
+                        emit(lastel.tail.rstrip(WS), text=True)
+                    # emit("\n")
+                elif el.tag == "table":
+                    if lastel is not None and lastel.tail is not None:
+                        emit(lastel.tail.rstrip(WS), text=True)
+                elif lastel is not None:
+                    emit(lastel.tail, text=True)
+                lastel = None
+                prespace = False
+                span = sourcespan(el) if source is not None else None
+                if span is not None:
+                    # unchanged since it was read, so copy it and its tail
+                    emit.raw(source[span[0]:span[1]])
+                    cref, book = _sourcestate(el, cref, book)
+                    if el is root:
+                        break
+                    res = True
+                    continue
+                if el.tag == "book":
+                    book = el.get("code", None)
+                if el.tag == "chapter":
+                    proc_start_ms(el, "chapter", "c", emit, "", escapes, version)
+                    cref = _chaptercref(el, cref, book)
+                elif el.tag == "verse":
+                    proc_start_ms(el, "verse", "v", emit, " ", escapes, version)
+                    cref = _versecref(el, cref, book)
+                elif el.tag == "book":
+                    emit.tag(el)
+                    emit(el.get("code"))
+                    prespace = True
+                elif el.tag in ("row", "para"):
+                    if 'vid' in el.attrib:
+                        r = Ref(el.get("vid", ""))
+                        if version < [3, 2] and (cref is None or forcevid or not _isnextref(cref, r, el)):
+                            emit(f"\\vid|{r}\\*\n")
+                        cref = r.last
+                    if (el.text is None or not el.text.strip(WS)) and (len(el) and el[0].tag in paraelements):
+                        emit.tag(el, sep="\n")
                     else:
-                        cref = Ref()
-            elif el.tag == "book":
-                emit.tag(el)
-                emit(el.get("code"))
-                prespace = True
-            elif el.tag in ("row", "para"):
-                if 'vid' in el.attrib:
-                    r = Ref(el.get("vid", ""))
-                    if version < [3, 2] and (cref is None or forcevid or not _isnextref(cref, r, el)):
-                        emit(f"\\vid|{r}\\*\n")
-                    cref = r.last
-                if (el.text is None or not el.text.strip(WS)) and (len(el) and el[0].tag in paraelements):
-                    emit.tag(el, sep="\n")
-                else:
+                        emit.tag(el)
+                elif el.tag in ("link", "char"):
                     emit.tag(el)
-            elif el.tag in ("link", "char"):
-                emit.tag(el)
-            elif el.tag in ("note", "sidebar"):
-                emit.tag(el, sep="")
-                if version >= [3, 2] and el.tag != "ms":
-                    append_attribs(el, emit, attribmap=attribmap, init=True)
-                if el.tag != "sidebar":
-                    emit(" {} ".format(el.get("caller")))
-                else:
+                elif el.tag in ("note", "sidebar"):
+                    emit.tag(el, sep="")
+                    if version >= [3, 2] and el.tag != "ms":
+                        append_attribs(el, emit, attribmap=attribmap, init=True)
+                    if el.tag != "sidebar":
+                        emit(" {} ".format(el.get("caller")))
+                    else:
+                        emit("\n")
+                    if version < [3, 2] and "category" in el.attrib:
+                        emit("\\cat {0}\\cat*".format(el.get("category")))
+                    innote = mcats.get(s, "") if el.tag == "note" else None
+                elif el.tag == "unmatched":
+                    emit.tag(el, sep="")
+                elif el.tag == "figure":
+                    if (v := el.get("file", None)) is not None:
+                        del el.attrib["file"]
+                        el.set("src", v)
+                    emit.tag(el)
+                elif el.tag == "cell":
+                    emit.tag(el)
+                elif el.tag == "optbreak":
+                    emit("//")
+                elif el.tag == "ms":
+                    emit.tag(el, sep="")
+                    isbare = mcats.get(s, "") != "milestone" and len(el.attrib) == 2 and el.get("x-bare", "false") == "true"
+                    append_attribs(el, emit, attribmap=attribmap, excludes=excludes + ["x-bare"])
+                    emit("\\*" if not isbare else ("" if el.tail and el.tail[0] in " \n" else " ")) # protective space
+                elif el.tag == "ref":
+                    if el.get('gen', 'false').lower() != 'true':
+                        emit("\\ref ")
+                elif el.tag == "usx":
+                    version =  el.get("version", [3,1])
+                    if isinstance(version, str):
+                        version = [int(x.strip(WS)) for x in version.split(".")]
+                elif el.tag in ("table", ):
+                    pass
+                elif el.tag == "periph":
+                    name = el.get("alt", None)
+                    emit("\\periph" + (" "+name if name else ""))
+                    append_attribs(el, emit, attribmap=attribmap, excludes=["alt"])
                     emit("\n")
-                if version < [3, 2] and "category" in el.attrib:
-                    emit("\\cat {0}\\cat*".format(el.get("category")))
-                innote = mcats.get(s, "") if el.tag == "note" else None
-            elif el.tag == "unmatched":
-                emit.tag(el, sep="")
-            elif el.tag == "figure":
-                if (v := el.get("file", None)) is not None:
-                    del el.attrib["file"]
-                    el.set("src", v)
-                emit.tag(el)
-            elif el.tag == "cell":
-                emit.tag(el)
-            elif el.tag == "optbreak":
-                emit("//")
-            elif el.tag == "ms":
-                emit.tag(el, sep="")
-                isbare = mcats.get(s, "") != "milestone" and len(el.attrib) == 2 and el.get("x-bare", "false") == "true"
-                append_attribs(el, emit, attribmap=attribmap, excludes=excludes + ["x-bare"])
-                emit("\\*" if not isbare else ("" if el.tail and el.tail[0] in " \n" else " ")) # protective space
-            elif el.tag == "ref":
-                if el.get('gen', 'false').lower() != 'true':
-                    emit("\\ref ")
-            elif el.tag == "usx":
-                version =  el.get("version", [3,1])
-                if isinstance(version, str):
-                    version = [int(x.strip(WS)) for x in version.split(".")]
-            elif el.tag in ("table", ):
-                pass
-            elif el.tag == "periph":
-                name = el.get("alt", None)
-                emit("\\periph" + (" "+name if name else ""))
-                append_attribs(el, emit, attribmap=attribmap, excludes=["alt"])
-                emit("\n")
-            else:
-                raise SyntaxError(el.tag)
-            if version >= [3, 2] and el.tag not in ("ms", "note", "sidebar", "verse", "chapter"):
-                append_attribs(el, emit, attribmap=attribmap, init=True)
-            if el.text is not None and len(el.text.lstrip(WS)):
-                if prespace:
-                    emit(" ")
-                if not(len(el)) and prespace:
-                    emit(el.text.strip(WS), text=True)
                 else:
-                    emit(el.text.lstrip(WS), text=True)
-            lastel = None
-            lastopen = el
+                    flush()
+                    raise SyntaxError(el.tag)
+                if version >= [3, 2] and el.tag not in ("ms", "note", "sidebar", "verse", "chapter"):
+                    append_attribs(el, emit, attribmap=attribmap, init=True)
+                if el.text is not None and len(el.text.lstrip(WS)):
+                    if prespace:
+                        emit(" ")
+                    if not(len(el)) and prespace:
+                        emit(el.text.strip(WS), text=True)
+                    else:
+                        emit(el.text.lstrip(WS), text=True)
+                lastel = None
+                lastopen = el
+
+            elif ev == "end":
+                if el.tag in ("para", "row", "sidebar", "book", "chapter"):
+                    if lastel is not None and lastel.tail is not None:
+                        emit(lastel.tail.rstrip(WS), text=True)
+                    emit("\n")
+                elif lastel is not None and lastel.tail is not None:
+                    emit(lastel.tail, text=True)
+                if el.tag == "note":
+                    emit("\\{}*".format(s))
+                    innote = None
+                elif el.tag in ("char", "link", "figure") and (not innote or mcats.get(s, "") != innote + "char"):
+                    if version <= [3, 1]:
+                        append_attribs(el, emit, attribmap=attribmap)
+                    emit("\\{}*".format(s))
+                elif el.tag == "sidebar":
+                    emit("\n\\{}e\n".format(s))
+                elif el.tag == "ref" and el.get('gen', 'false').lower() != 'true':
+                    append_attribs(el, emit, attribmap=attribmap, nows=True)
+                    emit("\\ref*")
+                elif el.tag == "book":
+                    emit("\n")
+                    if version >= [3, 1]:
+                        emit("\\usfm {}\n".format(".".join([str(x) for x in version])))
+                lastel = el
+                if el is root:
+                    break
+        flush()
+        return lastel, cref
 
-        elif ev == "end":
-            if el.tag in ("para", "row", "sidebar", "book", "chapter"):
-                if lastel is not None and lastel.tail is not None:
-                    emit(lastel.tail.rstrip(WS), text=True)
-                emit("\n")
-            elif lastel is not None and lastel.tail is not None:
-                emit(lastel.tail, text=True)
-            if el.tag == "note":
-                emit("\\{}*".format(s))
-                innote = None
-            elif el.tag in ("char", "link", "figure") and (not innote or mcats.get(s, "") != innote + "char"):
-                if version <= [3, 1]:
-                    append_attribs(el, emit, attribmap=attribmap)
-                emit("\\{}*".format(s))
-            elif el.tag == "sidebar":
-                emit("\n\\{}e\n".format(s))
-            elif el.tag == "ref" and el.get('gen', 'false').lower() != 'true':
-                append_attribs(el, emit, attribmap=attribmap, nows=True)
-                emit("\\ref*")
-            elif el.tag == "book":
-                emit("\n")
-                if version >= [3, 1]:
-                    emit("\\usfm {}\n".format(".".join([str(x) for x in version])))
-            lastel = el
-    return lastel, cref
+def usx2usfm(outf, root, grammar=None, lastel=None, version=None, escapes="", forcevid=False, cref=None, book=None, source=None, **kw):
+    """ Writes root as USFM to outf. If source is given, the top level elements
+        unchanged since xmlutils.marksources was run on them are copied from it rather than
+        being regenerated. Returns the last element and reference, to pass to
+        a following call. """
+    writer = USFMWriter(outf, root, grammar=grammar, lastel=lastel, version=version, escapes=escapes,
+                        forcevid=forcevid, cref=cref, book=book, source=source, **kw)
+    skip = []
+    for (ev, el) in iterels(root, ("start", "end"), skip=skip):
+        if writer.event(ev, el):
+            skip.append(el)
+    return writer.lastel, writer.cref
 
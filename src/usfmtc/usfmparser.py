@@ -9,9 +9,10 @@ from typing import Optional, Dict, Any, List, Type, Union
 WS = "\t\n\r "   # \v\f\u001C\u001D\u001E\u001F "  full python ASCII WS
 
 class Pos:
-    def __init__(self, l: int, c: int, **kw) -> None:
+    def __init__(self, l: int, c: int, offset: Optional[int]=None, **kw) -> None:
         self.l = l
         self.c = c
+        self.offset = offset    # index into the source text, where known
         self.kw = kw
 
     def __str__(self) ->str:
@@ -21,7 +22,7 @@ class Pos:
         return f"Pos({self.l}:{self.c})"
 
     def copy(self) -> 'Pos':
-        return self.__class__(self.l, self.c, **self.kw)
+        return self.__class__(self.l, self.c, offset=self.offset, **self.kw)
 
 class Tag(str):
     pos: Pos
@@ -216,6 +217,7 @@ class Lexer:
                     tagname = self.processtag(t.group(0))
                     extras = {"xp": self.currxpand} if self.expanded else {}
                     res = self.tagger(tagname, l=self.lindex, c=curri-self.lpos, **extras)
+                    res.pos.offset = curri - 1
                     curri += t.end()
                     break
             elif n == '|':
@@ -716,45 +718,83 @@ class USFMParser:
         return self.grammar.marker_categories.get(tag, "")
 
     def parse(self):
+        for e in self.iterparse():
+            pass
+        return self.stack[0].element
+
+    def iterparse(self, detach=False):
+        """ Parses the text, yielding each top level element of the result once
+            nothing more can be added to it. The root is self.rootnode.element.
+            If detach, each element is removed from the root after it is yielded,
+            so that only the elements not yet yielded are held. """
         self.result = []
         self.stack = []
         self.rootnode = Node(self, 'usx', None)
         self.rootnode.addAttributes({'version': '3.0'})
         self.parent = self.rootnode
         self.stack.append(self.rootnode)
+        root = self.rootnode.element
+        done = 0
 
         for t in self.lexer:
-            if isinstance(t, Tag):
-                tag = self.grammar.parsetag(t.basestr())
-                if t.basestr() == "":
-                    cattype = "milestone"
-                else:
-                    cattype = self.grammar.marker_categories.get(tag, 'internal')
-                for tagtype in ("_"+tag, cattype):
-                    fn = getattr(self, tagtype, None)
-                    if fn is not None:
-                        try:
-                            self.parent = fn(t)
-                        except FallBackError:
-                            continue
-                        except AttributeError as e:
-                            self.error(e, e.msg, self.lexer.currpos())
-                        break
-                else:
-                    self.parent = self.unknown(t)
-                continue
-            if self.parent is None:
-                continue
-            if isinstance(t, Attribs):
-                self.parent.addAttributes(t)
-            elif isinstance(t, AttribText):
-                self.parent.addDefaultAttrib(t)
-            elif isinstance(t, OptBreak):
-                self.parent.appendElement(t)
-            elif isinstance(t, String):
-                self.parent.appendText(t)
-        return self.stack[0].element
+            if len(root) > done + 1:
+                # all but the last top level element are complete, unless still open
+                while done < len(root) - 1 and not self._isopen(root[done]):
+                    yield root[done]
+                    if detach:
+                        del root[done]
+                    else:
+                        done += 1
+            self._dotoken(t)
+        while done < len(root):
+            yield root[done]
+            if detach:
+                del root[done]
+            else:
+                done += 1
+
+    def _isopen(self, e):
+        """ Is e, a top level element, or anything in it still on the stack """
+        for n in self.stack[1:]:
+            x = getattr(n, 'element', None)
+            while x is not None and x is not e:
+                if not hasattr(x, 'parent'):
+                    return True     # cannot tell without parent links
+                x = x.parent
+            if x is e:
+                return True
+        return False
 
+    def _dotoken(self, t):
+        if isinstance(t, Tag):
+            tag = self.grammar.parsetag(t.basestr())
+            if t.basestr() == "":
+                cattype = "milestone"
+            else:
+                cattype = self.grammar.marker_categories.get(tag, 'internal')
+            for tagtype in ("_"+tag, cattype):
+                fn = getattr(self, tagtype, None)
+                if fn is not None:
+                    try:
+                        self.parent = fn(t)
+                    except FallBackError:
+                        continue
+                    except AttributeError as e:
+                        self.error(e, e.msg, self.lexer.currpos())
+                    break
+            else:
+                self.parent = self.unknown(t)
+            return
+        if self.parent is None:
+            return
+        if isinstance(t, Attribs):
+            self.parent.addAttributes(t)
+        elif isinstance(t, AttribText):
+            self.parent.addDefaultAttrib(t)
+        elif isinstance(t, OptBreak):
+            self.parent.appendElement(t)
+        elif isinstance(t, String):
+            self.parent.appendText(t)
 
     def error(self, e, msg, pos):
         if pos is None:
@@ -1,5 +1,11 @@
 
 from usfmtc.xmlutils import ParentElement
+from usfmtc.usfmparser import USFMParser
+from usfmtc.usxmodel import normalisechild, _normroot
+from usfmtc.utils import readsrc, getSrcName
+from usfmtc.jsonstream import iterjson
+from json.encoder import encode_basestring, encode_basestring_ascii
+import json, io, os
 
 SPEC_NAME="USJ"
 VERSION_NUM="3.1"
@@ -60,6 +66,236 @@ def convert_usx(input_usx_elmt):
     # Now the USX samples in testsuite are not correct
     return out_obj, action
 
+_noattribs = ("style", "vid", "closed", "status")
+_end = object()
+
+def _usjhead(el):
+    ''' Returns the type and the dict of the fields, other than content, that
+        convert_usx gives for an element '''
+    key = el.tag
+    if key in ('row', 'cell'):
+        key = "table:"+key
+    res = {"type": key}
+    tag = el.get("style", None)
+    if tag:
+        res["marker"] = tag
+    for k, v in el.attrib.items():
+        if k not in _noattribs:
+            res[k] = v
+    return key, tag, res
+
+def _usjitems(el):
+    ''' Returns the content items of an element as convert_usx would list them '''
+    res = []
+    if el.text:
+        res.append(el.text)
+    for c in el:
+        if c.tag not in ("verse", "chapter") or "eid" not in c.attrib:
+            res.append(c)
+        if c.tail and c.tail.strip() != "":
+            res.append(c.tail)
+    return res
+
+class USJWriter:
+    ''' Writes USJ to outf while walking USX elements, without building the
+        dicts of usxtousj. The output is the same as json.dumps of usxtousj
+        with the given indent. If indent is None the output is compact, with no
+        whitespace. Writes are made in chunks of about bufsize. Call start()
+        with the root, add() with each item of its content and then end(), or
+        give each (event, element) of a walk of the root to event(). '''
+
+    def __init__(self, outf, indent=2, ensure_ascii=False, bufsize=65536):
+        self.outf = outf
+        self.indent = indent
+        self.ensure_ascii = ensure_ascii
+        self.enc = encode_basestring_ascii if ensure_ascii else encode_basestring
+        self.keysep = ": " if indent is not None else ":"
+        self.nls = ["" if indent is None else "\n" + " " * (indent * i) for i in range(32)]
+        self.keys = {}
+        self.bufsize = bufsize
+        self.buf = []
+        self.size = 0
+        self.first = True
+        self.closing = None
+        self.frames = None      # for event()
+
+    def _key(self, k):
+        res = self.keys.get(k, None)
+        if res is None:
+            res = self.keys[k] = self.enc(k) + self.keysep
+        return res
+
+    def _head(self, head, ind):
+        ''' Returns the { and the fields of head, at indent ind '''
+        enc = self.enc
+        parts = ["{"]
+        sep = ind
+        for k, v in head.items():
+            parts.append(sep + self._key(k) + (enc(v) if isinstance(v, str)
+                                    else json.dumps(v, ensure_ascii=self.ensure_ascii)))
+            sep = "," + ind
+        return parts
+
+    def _open(self, el, d, frames):
+        ''' Returns the start of the object for el whose { is at depth d,
+            pushing a frame for its content if it has any children '''
+        nls = self.nls
+        while len(nls) < d + 3:
+            nls.append("" if self.indent is None else "\n" + " " * (self.indent * len(nls)))
+        typ, tag, head = _usjhead(el)
+        ind = nls[d+1]
+        parts = self._head(head, ind)
+        closing = nls[d] + "}"
+        items = _usjitems(el)
+        if not len(items):
+            if typ not in ("chapter", "verse", "optbreak", "ms") and tag not in ("va", "ca", "b"):
+                parts.append("," + ind + self._key("content") + "[]")
+        elif len(el):
+            parts.append("," + ind + self._key("content") + "[")
+            frames.append([iter(items), d+2, True, ind + "]" + closing, el])
+            return "".join(parts)
+        else:
+            parts.append("," + ind + self._key("content") + "[" + nls[d+2] + self.enc(items[0]) + ind + "]")
+        parts.append(closing)
+        return "".join(parts)
+
+    def _write(self, s):
+        self.buf.append(s)
+        self.size += len(s)
+        if self.size >= self.bufsize:
+            self.outf.write("".join(self.buf))
+            self.buf = []
+            self.size = 0
+
+    def start(self, root):
+        ''' Writes the fields of the top level USJ object from root '''
+        typ, tag, head = _usjhead(root)
+        head["type"] = SPEC_NAME
+        closing = self.nls[0] + "}"
+        if "version" not in head:
+            closing = "," + self.nls[1] + self._key("version") + self.enc(VERSION_NUM) + closing
+        parts = self._head(head, self.nls[1])
+        parts.append("," + self.nls[1] + self._key("content") + "[")
+        self._write("".join(parts))
+        self.closing = closing
+        self.first = True
+
+    def add(self, item):
+        ''' Writes an item (string or element) of the top level content '''
+        s = self.nls[2] if self.first else "," + self.nls[2]
+        self.first = False
+        if isinstance(item, str):
+            self._write(s + self.enc(item))
+            return
+        frames = []     # [iterator of content items, depth of items, is first item, closing text, element]
+        self._write(s + self._open(item, 2, frames))
+        enc = self.enc
+        nls = self.nls
+        while frames:
+            frame = frames[-1]
+            item = next(frame[0], _end)
+            if item is _end:
+                frames.pop()
+                s = frame[3]
+            else:
+                s = nls[frame[1]] if frame[2] else "," + nls[frame[1]]
+                frame[2] = False
+                if isinstance(item, str):
+                    s += enc(item)
+                else:
+                    s += self._open(item, frame[1], frames)
+            self._write(s)
+
+    def _upto(self, frame, el=None):
+        ''' Returns the strings in the content of frame before el, or to its end '''
+        nl = self.nls[frame[1]]
+        res = ""
+        for item in frame[0]:
+            if item is el:
+                break
+            res += (nl if frame[2] else "," + nl) + self.enc(item)
+            frame[2] = False
+        return res
+
+    def event(self, ev, el):
+        ''' Writes the output for an event. Returns True for the start of an
+            element that is not output, so need not be walked. '''
+        frames = self.frames
+        if ev == "end":
+            if frames[-1][4] is el:
+                frame = frames.pop()
+                s = self._upto(frame)
+                if len(frames):
+                    self._write(s + frame[3])
+                else:
+                    self._write(s)
+                    self.first = frame[2]
+                    self.frames = None
+                    self.end()
+        elif frames is None:
+            self.start(el)
+            self.frames = [[iter(_usjitems(el)), 2, True, None, el]]
+        elif el.tag in ("verse", "chapter") and "eid" in el.attrib:
+            return True
+        else:
+            frame = frames[-1]
+            s = self._upto(frame, el)
+            s += self.nls[frame[1]] if frame[2] else "," + self.nls[frame[1]]
+            frame[2] = False
+            self._write(s + self._open(el, frame[1], frames))
+
+    def end(self):
+        ''' Closes the top level object and writes anything still buffered '''
+        self._write(("]" if self.first else self.nls[1] + "]") + self.closing)
+        self.outf.write("".join(self.buf))
+        self.buf = []
+        self.size = 0
+
+def writeusj(outf, input_usx, indent=2, ensure_ascii=False, bufsize=65536):
+    ''' Writes the USJ of a USX tree to outf as it walks the tree. See USJWriter '''
+    writer = USJWriter(outf, indent=indent, ensure_ascii=ensure_ascii, bufsize=bufsize)
+    writer.start(input_usx)
+    for item in _usjitems(input_usx):
+        writer.add(item)
+    writer.end()
+
+def usfmtousj(outf, src, grammar=None, canonical=False, indent=2, ensure_ascii=False,
+              bufsize=65536, elfactory=None, **kw):
+    ''' Converts USFM from src to USJ written to outf, without keeping the USX
+        tree. Each top level element is cleaned up, and canonicalised if
+        canonical, as USX.fromUsfm does, then written out and dropped as soon as
+        the parser has finished it. Returns the list of parser errors. '''
+    readerr = None
+    try:
+        data = readsrc(src, errors='strict')
+    except UnicodeError as e:
+        readerr = f"In file {getSrcName(src)}: {e}"
+        data = readsrc(src)
+    p = USFMParser(data, factory=elfactory or ParentElement, grammar=grammar, **kw)
+    writer = USJWriter(outf, indent=indent, ensure_ascii=ensure_ascii, bufsize=bufsize)
+    root = None
+    def begin():
+        root = p.rootnode.element
+        _normroot(root, True, canonical)
+        writer.start(root)
+        if root.text:
+            writer.add(root.text)
+        return root
+    for e in p.iterparse(detach=True):
+        if root is None:
+            root = begin()
+        normalisechild(e, root, canonical=canonical)
+        if e.tag not in ("verse", "chapter") or "eid" not in e.attrib:
+            writer.add(e)
+        if e.tail and e.tail.strip() != "":
+            writer.add(e.tail)
+    if root is None:        # nothing in the document
+        begin()
+    writer.end()
+    if readerr is not None:
+        p.errors.insert(0, (readerr,))
+    return p.errors
+
 def usjtousx(adict, elfactory=None):
     if elfactory is None:
         elfactory = ParentElement       # Needed for adding esid_s. Or use lxml
@@ -95,3 +331,116 @@ def convert_usj(json_node, usx_head, elfactory):
             else:
                 convert_usj(item, new_node, elfactory)
     return new_node
+
+def _jsonvalue(event, value, events):
+    ''' Returns the value that starts with (event, value), taking the rest of
+        it from events '''
+    if event not in ("start_map", "start_array"):
+        return value
+    res = {} if event == "start_map" else []
+    stack = [[res, None]]        # [container, key] for each open container
+    for event, value in events:
+        top = stack[-1]
+        if event == "map_key":
+            top[1] = value
+            continue
+        elif event in ("end_map", "end_array"):
+            stack.pop()
+            if not len(stack):
+                return res
+            continue
+        elif event in ("start_map", "start_array"):
+            value = {} if event == "start_map" else []
+            stack.append([value, None])
+        if isinstance(top[0], list):
+            top[0].append(value)
+        else:
+            top[0][top[1]] = value
+    raise ValueError("Unexpected end of JSON")
+
+def _setusjattribs(el, attribs):
+    ''' Sets the tag and attributes of el from those not yet used in attribs '''
+    if "type" in attribs:
+        el.tag = attribs.pop("type").replace("table:", "")
+    if "marker" in attribs:
+        el.set("style", attribs.pop("marker"))
+    for k, v in attribs.items():
+        el.set(k, v)
+    attribs.clear()
+
+def _openusj(src, errors):
+    ''' Returns a file object to read src from and whether to close it '''
+    if hasattr(src, "read"):
+        return src, False
+    elif isinstance(src, str) and os.path.exists(src):
+        return open(src, encoding="utf-8", errors=errors), True
+    data = readsrc(src)
+    if isinstance(data, bytes):
+        return io.BytesIO(data), True
+    return io.StringIO(data), True
+
+def iterusj(src, elfactory=None, bufsize=65536, errors="replace", pure=False):
+    ''' Reads USJ from src (a file object, path or string) incrementally and
+        yields each element of the USX as soon as it is complete, so children
+        come before their parents and the root comes last. The tree is built
+        as the content arrays are read, without recursion, and gives the same
+        result as usjtousx. The JSON is tokenized by ijson if it is installed,
+        unless pure. '''
+    if elfactory is None:
+        elfactory = ParentElement
+    inf, doclose = _openusj(src, errors)
+    try:
+        events = iterjson(inf, bufsize=bufsize, pure=pure)
+        event, value = next(events, (None, None))
+        if event != "start_map":
+            raise ValueError("USJ must be a JSON object")
+        root = elfactory('usx')
+        stack = [[root, None, False]]   # [element, unused attributes, in content]
+        for event, value in events:
+            top = stack[-1]
+            el = top[0]
+            if top[2]:
+                if event == "string":
+                    if el is root:
+                        if len(root):
+                            root[-1].tail = (root[-1].tail or "") + value
+                        else:
+                            root.text = (root.text or "") + value
+                    elif len(el) == 0:
+                        el.text = value
+                    else:
+                        el[-1].tail = value
+                elif event == "start_map":
+                    new = elfactory("", parent=el)
+                    el.append(new)
+                    stack.append([new, {}, False])
+                elif event == "end_array":
+                    top[2] = False
+                else:
+                    raise ValueError(f"Unexpected {event} in USJ content")
+            elif event == "map_key":
+                if value == "content":
+                    if next(events, (None,))[0] != "start_array":
+                        raise ValueError("USJ content must be an array")
+                    if top[1] is not None:
+                        _setusjattribs(el, top[1])
+                    top[2] = True
+                else:
+                    v = _jsonvalue(*next(events), events)
+                    if top[1] is not None:      # the root's attributes are not kept
+                        top[1][value] = v
+            elif event == "end_map":
+                stack.pop()
+                if top[1] is not None:
+                    _setusjattribs(el, top[1])
+                yield el
+    finally:
+        if doclose:
+            inf.close()
+
+def readusj(src, elfactory=None, bufsize=65536, errors="replace", pure=False):
+    ''' Returns the root of the USX read incrementally from the USJ in src '''
+    root = None
+    for root in iterusj(src, elfactory=elfactory, bufsize=bufsize, errors=errors, pure=pure):
+        pass
+    return root
@@ -1,6 +1,6 @@
 
-from usfmtc.usxmodel import iterusx, iterusxref
-from usfmtc.xmlutils import isempty
+from usfmtc.usxmodel import iterusx, iterusxref, ethash
+from usfmtc.xmlutils import isempty, RangeElement
 from usfmtc.reference import _MarkerRef
 from dataclasses import dataclass
 import xml.etree.ElementTree as et
@@ -119,11 +119,12 @@ def _scanel(refmrkr, usx, parindex, rend=None, verseonly=False):
                     return None, None
         parindex += 1
 
-def _findcvel(ref, usx, atend=False, parindex=0):
+def _findcvel(ref, usx, atend=False, parindex=0, cache=None):
     ''' Returns an element and mrkr index for a reference in a document. If atend
         _findcvel will return the element containing the endpoint or if that is at
         the end of the elment, the next element. parindex speeds up the hunt for the
-        chapter.'''
+        chapter. cache is a dict to hold chapter and verse positions across calls
+        on an unchanging document.'''
     resm = 0
     if ref.book is not None and usx.book != ref.book:
         raise ValueError("Reference book {} != text book {}".format(ref, usx.book))
@@ -133,20 +134,28 @@ def _findcvel(ref, usx, atend=False, parindex=0):
 
     # find a parindex for the given chapter
     if c is not None and c > 0:
-        for pari, el in enumerate(root[parindex:], start=parindex):
-            if el.tag == "chapter" and int(el.get('number', 0)) == c:
-                parindex = pari
-                if atend and not foundend:
-                    startparindex = pari
-                    c += 1
-                    foundend = True
-                else:
-                    break
+        ckey = ("c", parindex, c, atend)
+        if cache is not None and ckey in cache:
+            parindex, startparindex = cache[ckey]
         else:
-            if not atend:
-                raise ValueError("Chapter reference {} out of range".format(ref))
+            startparindex = None
+            for pari in range(parindex, len(root)):
+                el = root[pari]
+                if el.tag == "chapter" and int(el.get('number', 0)) == c:
+                    parindex = pari
+                    if atend and not foundend:
+                        startparindex = pari
+                        c += 1
+                        foundend = True
+                    else:
+                        break
             else:
-                parindex = len(root)
+                if not atend:
+                    raise ValueError("Chapter reference {} out of range".format(ref))
+                else:
+                    parindex = len(root)
+            if cache is not None:
+                cache[ckey] = (parindex, startparindex)
     v = ref.verse
 
     # scan for verse. Verses always have paragraphs as their parent
@@ -158,20 +167,26 @@ def _findcvel(ref, usx, atend=False, parindex=0):
                 testafter = True
         else:
             parindex += 1
-        while parindex < len(root):
-            n = root[parindex]
-            if n.tag == "chapter":
-                el = n
-                break
-            el = _findel(n, "verse", {"number": lambda n:testverse(str(v), n, after=testafter)}, limits=("chapter",))
-            if el is not None:
-                break
-            parindex += 1
+        vkey = ("v", parindex, str(v), testafter)
+        if cache is not None and vkey in cache:
+            el, parindex = cache[vkey]
         else:
-            if not atend:
-                raise ValueError("Reference verse {} out of range".format(ref))
+            while parindex < len(root):
+                n = root[parindex]
+                if n.tag == "chapter":
+                    el = n
+                    break
+                el = _findel(n, "verse", {"number": lambda n:testverse(str(v), n, after=testafter)}, limits=("chapter",))
+                if el is not None:
+                    break
+                parindex += 1
             else:
-                return None, 0
+                if not atend:
+                    raise ValueError("Reference verse {} out of range".format(ref))
+                else:
+                    return None, 0
+            if cache is not None:
+                cache[vkey] = (el, parindex)
     elif parindex >= len(root):
         return None, 0
     else:
@@ -297,12 +312,14 @@ def _findtextref(ref, el, cls, atend=False, mrkri=-1, startref=None, skiptest=No
 class USXCursor(ETCursor):
 
     @classmethod
-    def fromRef(cls, ref, usx, atend=False, parindex=0, skiptest=None):
+    def fromRef(cls, ref, usx, atend=False, parindex=0, skiptest=None, cache=None):
         ''' Returns a cursor for the given ref in the usx file. atend indicates
             that this is a final cursor, which is exclusive (so beyond the
             given ref). parindex speeds up the hunt by skipping paragraphs.
-            skiptest is a function to say whether this element causes a word break. '''
-        el, mrkri = _findcvel(ref, usx, atend=atend, parindex=parindex)
+            skiptest is a function to say whether this element causes a word break.
+            cache is a dict shared between calls that find many cursors in
+            a document before changing it. '''
+        el, mrkri = _findcvel(ref, usx, atend=atend, parindex=parindex, cache=cache)
         if el is None:
             return cls(None, "", 0)
         elref = ref.copy()
@@ -327,12 +344,24 @@ class USXCursor(ETCursor):
         return res
 
     def copy_range(self, root, b, addintro=False, skiptest=None, titles=True, headers=True,
-                                  chapters=True, vid=None, grammar=None, factory=None):
+                                  chapters=True, vid=None, grammar=None, factory=None, view=False):
         ''' Returns a usx document root containing paragraphs containing the content
-            up to but not including USXCursor b '''
+            up to but not including USXCursor b. If view is True, the result is a
+            read only RangeElement tree that shares whole elements with root
+            rather than copying them. '''
         a = self
         if factory is None:
-            factory = root.__class__
+            factory = RangeElement if view else root.__class__
+        if view:
+            share = lambda e, parent: e
+            # elements that are only partly in the range
+            partial = set()
+            for e in (a.el, b.el):
+                while e is not None:
+                    partial.add(id(e))
+                    e = getattr(e, 'parent', None)
+        else:
+            share = lambda e, parent: e.copy(deep=True, parent=parent, factory=factory)
         if a.el not in root:
             p = a.el.parent
             while p not in root:
@@ -359,14 +388,23 @@ class USXCursor(ETCursor):
                 if isendintro(eloc):
                     start = i
                     break
-                newp = eloc.copy(deep=True, parent=currp, factory=factory)
-                currp.append(newp)
+                currp.append(share(eloc, currp))
             curr = root
             currp = res
 
+        shared = None
         for eloc, isin in iterusx(root, parindex=start, start=a.el, until=b.el, untilafter=bool(b.attrib)):
+            if shared is not None:
+                if eloc is shared and not isin:
+                    shared = None
+                continue
             if isin and eloc == b.el:
                 break
+            elif view and isin and id(eloc) not in partial:
+                # wholly inside the range so no need to copy
+                currp.append(eloc)
+                shared = eloc
+                continue
             # at the start
             elif isin and eloc == a.el and eloc.tag not in ("para", "book", "sidebar", "chapter"):
                 # if we are at the start of the parent (para, since a verse is always only in a para) check for subheadings
@@ -382,8 +420,7 @@ class USXCursor(ETCursor):
                     i += 1
                     # copy all the section heads
                     for j in range(i, r.index(eloc.parent)):
-                        newp = r[j].copy(deep=True, parent=currp, factory=factory)
-                        currp.append(newp)
+                        currp.append(share(r[j], currp))
                 outp = factory(eloc.parent.tag, attrib=eloc.parent.attrib, parent=currp)
                 if 'vid' not in eloc.parent.attrib:
                     outp.set('vid', eloc.get('vid', vid.str() if vid is not None else ''))
@@ -427,9 +464,77 @@ class USXCursor(ETCursor):
         else:
             p = a.el
         i = list(root).index(p)
-        for eloc, isin in iterusx(root, parindex=i, start=a.el, until=b.el, untilafter=bool(b.attrib)):
+        # an end cursor at the start of a milestone stops before it
+        untilafter = bool(b.attrib) and not (b.istext() and b.char < 0)
+        for eloc, isin in iterusx(root, parindex=i, start=a.el, until=b.el, untilafter=untilafter):
             t = a.textin(b, eloc, isin)
             if t:
                 res.append(t)
         return "".join(res)
 
+
+
+class TextIndex:
+    ''' The main text of a document as one string, with the offsets of each
+        chapter and verse in it. The text of whole verses, chapters and ranges
+        of them is then a slice rather than a walk of the tree. The index
+        notes the content hash of the document and is stale once that changes. '''
+
+    def __init__(self, root):
+        self.hash = ethash(root)
+        book = root.find("book")
+        self.book = book.get("code", None) if book is not None else None
+        self.starts = []        # text offset indexed by ordinal
+        self.ends = []
+        self.ords = {}          # (chapter, verse) strings to ordinal, verse None for a chapter
+        chapters = []
+        res = []
+        pos = 0
+        chap = None
+        for e, isin in iterusx(root):
+            if isin and e.tag in ("chapter", "verse") and e.get("eid", None) is None:
+                n = e.get("number", "")
+                if e.tag == "chapter":
+                    chap = n
+                    chapters.append(len(self.starts))
+                    self.ords[(n, None)] = len(self.starts)
+                else:
+                    self._addverse(chap, n, len(self.starts))
+                self.starts.append(pos)
+            t = e.text if isin else e.tail
+            if t:
+                res.append(t)
+                pos += len(t)
+        self.text = "".join(res)
+        self.ends = self.starts[1:] + [pos]
+        for i, c in enumerate(chapters):
+            self.ends[c] = self.starts[chapters[i+1]] if i < len(chapters) - 1 else pos
+
+    def _addverse(self, chap, n, o):
+        self.ords.setdefault((chap, n), o)
+        b = n.split("-")
+        if len(b) > 1 and b[0].isdigit() and b[-1].isdigit():
+            for v in range(int(b[0]), int(b[-1]) + 1):
+                self.ords.setdefault((chap, str(v)), o)
+
+    def isvalid(self, root):
+        ''' Is this index still a true copy of the document '''
+        return ethash(root) == self.hash
+
+    def ordinal(self, ref):
+        ''' Returns the ordinal of a whole verse or chapter ref or None '''
+        if ref.chapter is None or ref.word is not None or ref.char is not None \
+                or ref.subverse or ref.mrkrs:
+            return None
+        return self.ords.get((str(ref.chapter), None if ref.verse is None else str(ref.verse)), None)
+
+    def gettext(self, ref):
+        ''' Returns the text of a reference or range or None if the reference
+            is not of whole verses or chapters in the index '''
+        if any(r.book is not None and r.book != self.book for r in (ref.first, ref.last)):
+            return None
+        s = self.ordinal(ref.first)
+        e = self.ordinal(ref.last)
+        if s is None or e is None:
+            return None
+        return self.text[self.starts[s]:self.ends[e]]
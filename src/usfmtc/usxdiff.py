@@ -0,0 +1,134 @@
+
+from usfmtc.usxmodel import ethash, chapterhashes, strnormal
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+import xml.etree.ElementTree as et
+from typing import List, Optional
+import hashlib, copy
+
+@dataclass
+class DiffOp:
+    ''' An edit of the top level elements of a document: replace root[start:end]
+        with new (elements from the other document). verses lists the verse
+        references whose text differs. '''
+    op: str                 # "insert", "delete" or "replace"
+    start: int
+    end: int
+    chapter: int | str
+    new: List[et.Element] = field(default_factory=list)
+    verses: List[str] = field(default_factory=list)
+
+def _getroot(doc):
+    return doc.getroot() if hasattr(doc, "getroot") else doc
+
+def _units(root):
+    ''' Returns a dict keyed by chapter of lists of (index, hash) of the top
+        level elements in root, and the chapters in document order '''
+    res = {}
+    order = []
+    curr = 0
+    for i, c in enumerate(root):
+        if c.tag == "chapter" and c.get("eid", None) is None:
+            try:
+                curr = int(c.get("number", "0"))
+            except ValueError:
+                curr = c.get("number", "0")
+        if curr not in res:
+            res[curr] = []
+            order.append(curr)
+        h = ethash(c) + strnormal(c.tail, root.tag, 2).encode("utf-8")
+        res[curr].append((i, hashlib.blake2b(h, digest_size=16).digest()))
+    return res, order
+
+def _versetexts(els, book, chapter):
+    ''' Returns a dict of normalised text keyed by verse reference string for
+        the list of elements '''
+    res = {}
+    curr = [f"{book} {chapter}:0"]
+    def addtext(t):
+        if t is not None and len(t.strip()):
+            res[curr[0]] = res.get(curr[0], "") + " " + " ".join(t.split())
+    def doel(e):
+        if e.tag == "chapter" and e.get("eid", None) is None:
+            curr[0] = f"{book} {e.get('number', '')}:0"
+        elif e.tag == "verse" and e.get("eid", None) is None:
+            curr[0] = "{}:{}".format(curr[0].split(":")[0], e.get("number", ""))
+            res.setdefault(curr[0], "")
+        addtext(e.text)
+        for c in e:
+            doel(c)
+            addtext(c.tail)
+    for e in els:
+        doel(e)
+    return res
+
+def _changedverses(olds, news, book, chapter):
+    a = _versetexts(olds, book, chapter)
+    b = _versetexts(news, book, chapter)
+    res = [k for k, v in b.items() if a.get(k, None) != v]
+    res += [k for k in a.keys() if k not in b]
+    return res
+
+def diff(usxa, usxb):
+    ''' Returns a list of DiffOps, in document order, that turn usxa into
+        usxb when passed to patch(). Only chapters whose content hashes differ
+        are aligned, so the time taken is proportional to the document size. '''
+    roota = _getroot(usxa)
+    rootb = _getroot(usxb)
+    bke = rootb.find("book")
+    book = bke.get("code", "") if bke is not None else ""
+    hasha = chapterhashes(roota)
+    hashb = chapterhashes(rootb)
+    unitsa, ordera = _units(roota)
+    unitsb, orderb = _units(rootb)
+    res = []
+
+    def nextstart(k):
+        ''' Where to insert a chapter k in a that is missing from a '''
+        for c in orderb[orderb.index(k)+1:]:
+            if c in unitsa:
+                return unitsa[c][0][0]
+        return len(roota)
+
+    for k in orderb:
+        ub = unitsb[k]
+        if k not in unitsa:
+            s = nextstart(k)
+            news = [rootb[i] for i, h in ub]
+            res.append(DiffOp("insert", s, s, k, news, _changedverses([], news, book, k)))
+            continue
+        if hasha.get(k) == hashb.get(k) and len(unitsa[k]) == len(ub):
+            continue
+        ua = unitsa[k]
+        sm = SequenceMatcher(None, [h for i, h in ua], [h for i, h in ub], autojunk=False)
+        for tag, i1, i2, j1, j2 in sm.get_opcodes():
+            if tag == "equal":
+                continue
+            s = ua[i1][0] if i1 < len(ua) else ua[-1][0] + 1
+            e = ua[i2-1][0] + 1 if i2 > i1 else s
+            olds = [roota[i] for i, h in ua[i1:i2]]
+            news = [rootb[i] for i, h in ub[j1:j2]]
+            res.append(DiffOp(tag, s, e, k, news, _changedverses(olds, news, book, k)))
+    for k in ordera:
+        if k not in unitsb:
+            ua = unitsa[k]
+            olds = [roota[i] for i, h in ua]
+            res.append(DiffOp("delete", ua[0][0], ua[-1][0] + 1, k, [],
+                              _changedverses(olds, [], book, k)))
+    res.sort(key=lambda o: o.start)
+    return res
+
+def patch(usx, ops):
+    ''' Applies the DiffOps from diff(usx, other) to usx, making it the same as
+        other. Returns usx. '''
+    root = _getroot(usx)
+    for op in reversed(ops):
+        news = []
+        for e in op.new:
+            if hasattr(e, "parent"):
+                n = e.copy(deep=True, parent=root)
+            else:
+                n = copy.deepcopy(e)
+            news.append(n)
+        root[op.start:op.end] = news
+    return usx
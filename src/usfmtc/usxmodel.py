@@ -1,5 +1,5 @@
 
-import re
+import re, hashlib
 from dataclasses import dataclass
 from usfmtc.xmlutils import isempty, ParentElement
 from usfmtc.usfmparser import Grammar, WS
@@ -234,10 +234,14 @@ escapes = {
 }
 
 escapere = re.compile(r"(\\[n~\\|]|~)")
+_nbsptable = str.maketrans({'~': '\u00A0'})
 def add_specials(t, node, parent, istext=False):
     if t is None:
         return t
-    t = escapere.sub(lambda m: escapes.get(m.group(1), m.group(1)[1:]), t)
+    if "\\" in t:
+        t = escapere.sub(lambda m: escapes.get(m.group(1), m.group(1)[1:]), t)
+    elif "~" in t:
+        t = t.translate(_nbsptable)
     return t
 
 alignments = {
@@ -253,6 +257,16 @@ def _stripws(s, atend=False):
 
 backre = re.compile(r"\\([\\~|])")
 def cleanup(node, parent=None):
+    node = _cleannode(node, parent)
+    node.text = add_specials(node.text, node, parent)
+    for c in node:
+        cleanup(c, parent=node)
+    node.tail = add_specials(node.tail, node, parent)
+
+def _cleannode(node, parent):
+    ''' Does the cleanup of node itself (not its text, tail or children).
+        Returns the node whose text and children are still to be cleaned, which
+        differs from node if its content has been wrapped in a new element. '''
     if node.tag == 'para':
         # cleanup spaces at start and end of para
         i = -1
@@ -306,15 +320,13 @@ def cleanup(node, parent=None):
             node = refnode
     # strip character escapes
     for k, v in node.attrib.items():
-        node.attrib[k] = backre.sub(r"\1", v)
+        if "\\" in v:
+            node.attrib[k] = backre.sub(r"\1", v)
     #if node.text is not None:
     #    node.text = backre.sub(r"\1", node.text)
     #if node.tail is not None:
     #    node.tail = backre.sub(r"\1", node.tail)
-    node.text = add_specials(node.text, node, parent)
-    for c in node:
-        cleanup(c, parent=node)
-    node.tail = add_specials(node.tail, node, parent)
+    return node
 
 _attribre = re.compile(r'(["=|\\~/])')
 _textre = re.compile(r'([=|\\~/])')
@@ -332,6 +344,8 @@ unescapes = {
     "&apos;": "'"
 }
 
+_normwsre = re.compile("[\n\t\r ]+")
+_normnlre = re.compile(r"[ \n]*\n[ ]*")
 def strnormal(s, t, mode=0):
     ''' strips whitespace according to element type and mode:
         mode & 1 strips lhs
@@ -339,15 +353,17 @@ def strnormal(s, t, mode=0):
     '''
     if s is None:
         return ""
-    res = re.sub("[\n\t\r ]+", " ", s) if t in ('para', 'char') else s
+    res = _normwsre.sub(" ", s) if t in ('para', 'char') else s
     if mode & 1 == 1:
         res = res.lstrip(WS)
     if mode & 2 == 2:
         res = res.rstrip(WS)
-    res = re.sub(r"[ \n]*\n[ ]*", "\n", res)
-    for k, v in unescapes.items():
-        if k in res:
-            res = res.replace(k, v)
+    if "\n" in res:
+        res = _normnlre.sub("\n", res)
+    if "&" in res:
+        for k, v in unescapes.items():
+            if k in res:
+                res = res.replace(k, v)
     return res
 
 notechars = [
@@ -372,6 +388,10 @@ def canonicalise(node, endofpara=False, factory=et, version=None):
         if c.tail is not None:
             mode = 2 if eop or c.tag in ("para", "sidebar") else 0
             c.tail = strnormal(c.tail, c.tag, mode)
+    _canonfinish(node, version)
+
+def _canonfinish(node, version):
+    ''' Structural canonicalisation of node once its children are done '''
     if node.tag == "note":
         # ensure text directly in a note ends up in an ft or xt
         style = node.get("style", "")
@@ -434,6 +454,60 @@ def canonicalise(node, endofpara=False, factory=et, version=None):
         node[0].tail = node.tail
         node.parent.remove(node)
 
+def normalise(node, clean=True, canonical=True, version=None):
+    ''' Applies cleanup and/or canonicalise in a single walk of the tree, with
+        the same result as calling them one after the other. '''
+    if version is None:
+        version = node.get("version", "3.0")
+    _normnode(node, None, False, version, clean, canonical)
+
+def normalisechild(node, root, clean=True, canonical=True, version=None):
+    ''' Normalises node, a child of root (the top of the tree), as normalise(root)
+        would, so that a document can be normalised one top level element at a
+        time as it is parsed '''
+    if version is None:
+        version = root.get("version", "3.0")
+    eop = canonical and node.tag == 'para'
+    _normnode(node, root, eop, version, clean, canonical)
+    if canonical and node.tail is not None:
+        mode = 2 if eop or node.tag in ("para", "sidebar") else 0
+        node.tail = strnormal(node.tail, node.tag, mode)
+
+def _normroot(node, clean, canonical):
+    ''' Normalises the text of the top of the tree as normalise would '''
+    if clean:
+        node.text = add_specials(node.text, node, None)
+    if canonical and node.text is not None:
+        node.text = strnormal(node.text, node.tag, 1)
+
+def _normnode(node, parent, endofpara, version, clean, canonical, local=True):
+    inner = node
+    specials = clean
+    if clean and local:
+        inner = _cleannode(node, parent)
+        if inner is not node:       # content moved into inner, clean it there
+            specials = False
+    if specials:
+        # cleanup does the tail after the children, but they never touch it
+        node.tail = add_specials(node.tail, node, parent)
+        node.text = add_specials(node.text, node, parent)
+    if canonical:
+        if node.text is not None:
+            node.text = strnormal(node.text, node.tag, 1)
+        lasti = 0
+        for lasti, e in enumerate(reversed(node)):
+            if e.tag not in ('char', 'note'):
+                break
+        lasti = len(node) - 1 - lasti
+    for i, c in enumerate(node):
+        eop = canonical and (c.tag == 'para' or (endofpara and (i == lasti) and not c.tail))
+        _normnode(c, node, eop, version, clean, canonical, local=inner is node)
+        if canonical and c.tail is not None:
+            mode = 2 if eop or c.tag in ("para", "sidebar") else 0
+            c.tail = strnormal(c.tail, c.tag, mode)
+    if canonical:
+        _canonfinish(node, version)
+
 def _sp(s, o):
     return (s or "") + (o or "")
 
@@ -576,6 +650,56 @@ def etCmp(a, b, at=None, bt=None, verbose=False, endofpara=False, print=print):
     return True
 
 
+def ethash(node, endofpara=False):
+    """ Returns a content hash of node normalised as etCmp compares it, so
+        that nodes that etCmp considers equal have equal hashes. Hashes are
+        cached on ParentElements and cleared when they are changed. """
+    cache = node.__dict__.get('_hashes', None) if isinstance(node, ParentElement) else None
+    if cache is not None and endofpara in cache:
+        return cache[endofpara]
+    h = hashlib.blake2b(digest_size=16)
+    h.update(node.tag.encode("utf-8"))
+    for k, v in sorted(attribnorm(node.attrib).items()):
+        h.update(f"\0{k}={v}".encode("utf-8"))
+    mode = 1 if len(node) else 3
+    h.update(b"\1" + strnormal(node.text, node.tag, mode).encode("utf-8"))
+    children = listWithoutChapterVerseEnds(node)
+    lasti = 0
+    for lasti, e in enumerate(reversed(children)):
+        if e.tag not in ('char', 'note'):
+            break
+    lasti = len(children) - 1 - lasti
+    for i, c in enumerate(children):
+        eop = node.tag == 'para' or endofpara and (i == lasti)
+        h.update(b"\2" + ethash(c, endofpara=eop))
+        mode = 2 if eop or node.tag != "char" else 0
+        h.update(b"\3" + strnormal(c.tail, node.tag, mode).encode("utf-8"))
+    res = h.digest()
+    if isinstance(node, ParentElement):
+        node.cachehash(endofpara, res)
+    return res
+
+def chapterhashes(root):
+    """ Returns a dict of content hashes for each chapter, keyed by chapter
+        number, with 0 for anything before the first chapter. """
+    res = {}
+    curr = 0
+    h = hashlib.blake2b(digest_size=16)
+    for c in listWithoutChapterVerseEnds(root):
+        if c.tag == "chapter":
+            res[curr] = h.digest()
+            try:
+                curr = int(c.get("number", "0"))
+            except ValueError:
+                curr = c.get("number", "0")
+            h = hashlib.blake2b(digest_size=16)
+        eop = root.tag == 'para'
+        h.update(b"\2" + ethash(c, endofpara=eop))
+        h.update(b"\3" + strnormal(c.tail, root.tag, 2 if eop or root.tag != "char" else 0).encode("utf-8"))
+    res[curr] = h.digest()
+    return res
+
+
 def iterusx(root, parindex=0, start=None, until=None, untilafter=False, blocks=[], unblocks=False, filt=[], grammar=None):
     """ Iterates over root yielding a node and whether we are in or after (isin) the node. Once until is hit,
         iteration stops. The node matching until is entered if untilafter is True
@@ -830,13 +954,58 @@ def _addoblink(res, cref, tid, ttype):
     else:
         res[k] = r
 
+@dataclass
+class LinkageTable:
+    ''' Alignment spans as parallel columns '''
+    aids: List[str]
+    types: List[str]
+    starts: List[Ref]
+    ends: List[Ref]
+
+    @classmethod
+    def fromdict(cls, links):
+        res = cls([], [], [], [])
+        for (aid, atype), r in links.items():
+            res.aids.append(aid)
+            res.types.append(atype)
+            res.starts.append(r.first)
+            res.ends.append(r.last)
+        return res
+
+    def __len__(self):
+        return len(self.aids)
+
+    def __iter__(self):
+        ''' Yields (aid, type, start, end) '''
+        return zip(self.aids, self.types, self.starts, self.ends)
+
+def _removechildren(parent, dead):
+    ''' Removes the children of parent whose ids are in dead, merging their
+        tails into the preceding text, rebuilding the child list once. '''
+    kept = []
+    for c in parent:
+        if id(c) not in dead:
+            kept.append(c)
+        elif not len(kept):
+            if parent.text is None:
+                parent.text = c.tail
+            elif c.tail is not None:
+                parent.text += c.tail
+        elif kept[-1].tail is None:
+            kept[-1].tail = c.tail
+        elif c.tail is not None:
+            kept[-1].tail += c.tail
+    parent[:] = kept
+
 def getlinkages(usx):
+    ''' Removes alignment milestones (za, za-s, za-e) from the text returning a
+        dict of (aid, type): Ref or RefRange of the text they cover. '''
     res = {}
+    dead = {}
     for eloc, isin, cref in iterusxref(usx.getroot(), book=usx.book, skiptest=lambda e:e.tag=="ms" and e.get("style","").startswith("za")):
         if not isin:
             s = eloc.get("style", "")
             if eloc.tag == "ms" and s.startswith("za"):
-                i = eloc.parent.index(eloc)
                 lref = cref.first.copy()
                 key = (eloc.get("aid", ""), eloc.get("type", "unk"))
                 # spot word spans
@@ -847,24 +1016,61 @@ def getlinkages(usx):
                         and (key not in res or res[key].getchar(None) is None):
                     lref.setchar(None)
                 _addoblink(res, lref, *key)
-                if i == 0:
-                    if eloc.parent.text is None:
-                        eloc.parent.text = eloc.tail
-                    elif eloc.tail is not None:
-                        eloc.parent.text += eloc.tail
-                elif eloc.parent[i-1].tail is None:
-                    eloc.parent[i-1].tail = eloc.tail
-                elif eloc.tail is not None:
-                    eloc.parent[i-1].tail += eloc.tail
-                eloc.parent.remove(eloc)
+                # removed after the walk, once per parent
+                dead.setdefault(id(eloc.parent), (eloc.parent, set()))[1].add(id(eloc))
+    for parent, ids in dead.values():
+        _removechildren(parent, ids)
     return res
 
+def getlinkagetable(usx):
+    ''' As getlinkages but returns a LinkageTable '''
+    return LinkageTable.fromdict(getlinkages(usx))
+
+def _linkkey(r):
+    return (r.chapter or 0, r.verse or 0, r.getword(0) or 0, r.getchar(0) or 0)
+
 def insertlinkages(usx, links):
-    ''' links = [(ref, mrkr, atend, id, type)] '''
+    ''' links = [(ref, mrkr, atend, id, type)]. The cursors are found, in
+        reference order, before anything is inserted. Insertions are then made
+        from the end of each text backwards so that the offsets stay valid.
+        The result is as inserting each link in turn: at the same place, end
+        milestones come in reverse order before the others, in order. A link
+        to word 0 is placed relative to the text left by the links before it,
+        so it is inserted on its own. '''
     from usfmtc.usxcursor import USXCursor
-    for l in links:
-        loc = USXCursor.fromRef(l[0], usx, atend=l[2], skiptest=lambda e:e.tag=="ms" and e.get("style","").startswith("za"))
+    skiptest = lambda e:e.tag=="ms" and e.get("style","").startswith("za")
+    batch = []
+    for i, l in enumerate(links):
+        r = l[0].mrkrs[-1] if l[0].mrkrs else l[0]
+        if r.word != 0:
+            batch.append(i)
+            continue
+        _insertlinkbatch(usx, links, batch, skiptest)
+        batch = []
+        loc = USXCursor.fromRef(l[0], usx, atend=l[2], skiptest=skiptest)
         _insertoblink(loc, l[1], l)
+    _insertlinkbatch(usx, links, batch, skiptest)
+
+def _insertlinkbatch(usx, links, batch, skiptest):
+    from usfmtc.usxcursor import USXCursor
+    cache = {}
+    groups = {}
+    for i in sorted(batch, key=lambda i: _linkkey(links[i][0])):
+        l = links[i]
+        loc = USXCursor.fromRef(l[0], usx, atend=l[2], skiptest=skiptest, cache=cache)
+        if loc.el is None:
+            continue
+        groups.setdefault((id(loc.el), loc.attrib), []).append((loc, i))
+    for locs in groups.values():
+        loc = locs[0][0]
+        t = loc.el.text if loc.attrib == " text" else loc.el.tail
+        tlen = len(t) if t is not None else 0
+        # last first. Each insertion goes before those already at its place
+        def key(x):
+            c = tlen if x[0].char < 0 else x[0].char
+            return (c, 0, -x[1]) if links[x[1]][2] else (c, 1, x[1])
+        for loc, i in sorted(locs, key=key, reverse=True):
+            _insertoblink(loc, links[i][1], links[i])
 
 def _insertoblink(linkloc, tag, linfo):
     el = linkloc.el
@@ -888,7 +1094,10 @@ def _getref(e, book, lastchap=0):
     if refstr is None:
         num = e.get("number", "0")
         if e.tag == "verse":
-            ref = Ref(f"{book} {lastchap}:{num}")
+            if num.isascii() and num.isdigit() and lastchap is not None:     # skip the parser for plain verses
+                ref = Ref(book=book, chapter=int(lastchap), verse=int(num))
+            else:
+                ref = Ref(f"{book} {lastchap}:{num}")
         else:
             ref = Ref(book=book, chapter=num, verse=0)
     else:
@@ -909,57 +1118,71 @@ def reversify(usx, srcvrs, tgtvrs, reverse=False, keep=False, chnums=False):
     def isptype(e, s):
         return e.tag == "para" and usx.grammar.marker_categories.get(e.get("style", ""), None) == s
 
-    if tgtvrs is not None and srcvrs.issame_map(tgtvrs):
+    from usfmtc.versification import cached_pair
+    vpair = cached_pair(srcvrs, tgtvrs)
+    if vpair.same:
         return              # identical, nothing to do
     root = usx.getroot()
     bk = usx.book
     results = []
+    children = list(root)
+    n = len(children)
     chapters = [-1]
-    for i, e in enumerate(root):
+    for i, e in enumerate(children):
         if e.tag == "chapter":
             _list_insert(chapters, int(e.get("number", "0")), i, default=-1)
+    # nextvp[i] is the first versepara at or after i, nextvpara[i] the first
+    # non section para at or after i that contains a verse.
+    nextvp = [n] * (n + 1)
+    nextvpara = [n] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        e = children[i]
+        nextvp[i] = i if isptype(e, "versepara") else nextvp[i+1]
+        hasverse = not isptype(e, "sectionpara") and any(x.tag == "verse" for x in e)
+        nextvpara[i] = i if hasverse else nextvpara[i+1]
+    versed = set()      # versepara elements that have had a verse inserted
     curr = Ref(None)
     currc = 0
     skipverse = False
     skippara = -1
-    for i, pe in enumerate(root):
+    for i, pe in enumerate(children):
         if pe.tag == "chapter":
             ref = _getref(pe, bk)
             if ref is None:
                 continue
             currc = ref.chapter
-            oref = srcvrs.remap(ref, tgtvrs, reverse=reverse)
-            if oref.first.verse > 0:
-                for e in root[i+1:]:
-                    if isptype(e, "versepara"):
-                        if isinstance(oref, RefRange):
-                            vnum = "{}{}-{}{}".format(oref.first.verse, oref.first.subverse or "", oref.last.verse, oref.last.subverse or "")
-                        else:
-                            vnum = "{}{}".format(oref.verse, oref.subverse or "")
-                        newv = e.makeelement("verse", {"style": "v", "number": vnum})   # , "ssid": str(oref)})
-                        if keep:
-                            newv.set("pubnumber", "")
-                        newv.tail = e.text
-                        e.text = None
-                        e.insert(0, newv)
-                        skipverse = True
-                        break
-            for j, e in enumerate(root[i+1:]):
-                if not isptype(e, "sectionpara") and any(x.tag == "verse" for x in e):
-                    skippara = i + 1 + j
-                    break
+            oref = vpair.remap(ref, reverse=reverse)
+            j = nextvp[i+1]
+            if oref.first.verse > 0 and j < n:
+                e = children[j]
+                if isinstance(oref, RefRange):
+                    vnum = "{}{}-{}{}".format(oref.first.verse, oref.first.subverse or "", oref.last.verse, oref.last.subverse or "")
+                else:
+                    vnum = "{}{}".format(oref.verse, oref.subverse or "")
+                newv = e.makeelement("verse", {"style": "v", "number": vnum})   # , "ssid": str(oref)})
+                if keep:
+                    newv.set("pubnumber", "")
+                newv.tail = e.text
+                e.text = None
+                e.insert(0, newv)
+                versed.add(j)
+                skipverse = True
+            k = nextvpara[i+1]
+            if j < k and j in versed:
+                k = j
+            if k < n:
+                skippara = k
             continue
         oldpe = pe
-        for ve in pe:
+        for ive, ve in enumerate(pe):     # ive tracks pe.index(ve) even as verses are removed
             if ve.tag != "verse":
                 continue
             ref = _getref(ve, bk, lastchap=currc)
             if ref is None:
                 continue
-            oref = srcvrs.remap(ref, tgtvrs, reverse=reverse)
+            oref = vpair.remap(ref, reverse=reverse)
             # insert a chapter?
             if curr.book is None or oref.chapter > curr.chapter:
-                ive = pe.index(ve)
                 if ive != 0 or (pe.text and pe.text.strip() != ''):
                     newpe = root.makeelement(pe.tag, pe.attrib, pos=pe.pos)
                     newpe.text = pe.text
@@ -974,8 +1197,8 @@ def reversify(usx, srcvrs, tgtvrs, reverse=False, keep=False, chnums=False):
                     newc = root.makeelement("chapter", {"style": "c", "number": str(oref.chapter)}, pos=pe.pos)
                     results.append(newc)
                 else:
-                    s = chapters[oref.chapter]
-                    for e in root[s:]:
+                    for j in range(chapters[oref.chapter], n):
+                        e = children[j]
                         if e.tag == "chapter" or isptype(e, "sectionpara") \
                                     or isptype(e, "versepara") and not any(x.tag == "verse" for x in e):
                             results.append(e)
@@ -987,7 +1210,6 @@ def reversify(usx, srcvrs, tgtvrs, reverse=False, keep=False, chnums=False):
                 continue
             if curr.book is not None and oref == curr and (not keep or oref.verse == 0):
                 if ve.tail:
-                    ive = pe.index(ve)
                     if ive > 0:
                         pe[ive-1].tail = (pe[ive-1].tail or "") + ve.tail
                     else:
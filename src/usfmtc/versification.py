@@ -1,10 +1,16 @@
 
-import re, os
+import re, os, struct, mmap, traceback
 from functools import reduce
 from usfmtc.utils import readsrc, get_trace
 from usfmtc.reference import RefRange
+from bisect import bisect_right
 import logging
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 logger = logging.getLogger(__name__)
 
 versifications = {}
@@ -20,21 +26,274 @@ def cached_versification(fname):
             versifications[fname] = Versification(fpath)
     return versifications.get(fname, None)
 
+versification_pairs = {}
+
+def cached_pair(src, tgt):
+    """ Returns a VersificationPair for src to tgt, reusing an existing one
+        for the same two Versification objects. """
+    key = (src, tgt)
+    if key not in versification_pairs:
+        versification_pairs[key] = VersificationPair(src, tgt)
+    return versification_pairs[key]
+
+_vrsmagic = b"USFMVRS\x01"
+
+def compiled_path(fname):
+    """ Returns where the compiled form of a .vrs file is kept, in the user
+        cache directory, so that nothing is written beside installed files. """
+    fname = os.path.abspath(fname)
+    cachedir = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    key = fname.replace(os.sep, "_").replace(":", "_")
+    return os.path.join(cachedir, "usfmtc", key + "c")
+
+class _BinWriter:
+    def __init__(self):
+        self.dat = bytearray()
+
+    def int(self, v):
+        self.dat += struct.pack("<i", v)
+
+    def str(self, s):
+        b = (s or "").encode("utf-8")
+        self.int(len(b))
+        self.dat += b
+
+    def ref(self, r):
+        if isinstance(r, RefRange):
+            self.int(2)
+            self.ref(r.first)
+            self.ref(r.last)
+            return
+        if any(getattr(r, a, None) is not None for a in ('product', 'word', 'char', 'mrkrs')):
+            raise ValueError(f"Can't compile reference {r}")
+        self.int(1)
+        self.str(r.book)
+        self.int(-1 if r.chapter is None else r.chapter)
+        self.int(-1 if r.verse is None else r.verse)
+        self.str(r.subverse)
+
+class _BinReader:
+    def __init__(self, buf, pos=0):
+        self.buf = buf
+        self.pos = pos
+
+    def int(self):
+        res = struct.unpack_from("<i", self.buf, self.pos)[0]
+        self.pos += 4
+        return res
+
+    def ints(self, n):
+        res = list(struct.unpack_from(f"<{n}i", self.buf, self.pos))
+        self.pos += 4 * n
+        return res
+
+    def str(self):
+        n = self.int()
+        res = bytes(self.buf[self.pos:self.pos+n]).decode("utf-8")
+        self.pos += n
+        return res or None
+
+    def ref(self, vrs):
+        from usfmtc.reference import Ref
+        if self.int() == 2:
+            first = self.ref(vrs)
+            return RefRange(first, self.ref(vrs))
+        book = self.str()
+        chapter = self.int()
+        verse = self.int()
+        return Ref(book=book, chapter=None if chapter < 0 else chapter,
+                   verse=None if verse < 0 else verse, subverse=self.str(), versification=vrs)
+
+
+class VerseOrdinals:
+    ''' Numbers every verse of a versification from 0, running on across the
+        books in canonical order. Converts between references and ordinals in
+        constant time, and whole arrays of them at once (as numpy arrays if
+        numpy is installed). '''
+
+    def __init__(self, vrs):
+        from usfmtc.reference import books
+        self.vrs = vrs
+        self.order = sorted((b for b in vrs.vnums if b in books), key=lambda b: books[b])
+        self.bookindex = {b: i for i, b in enumerate(self.order)}
+        self.bookstarts = {}
+        self.bases = []
+        self.chapoffsets = []   # index in chapstarts of chapter 1 of each book
+        self.chapstarts = []    # ordinal of verse 1 of each chapter and the end of each book
+        self.numchaps = []
+        total = 0
+        for b in self.order:
+            vbk = vrs.vnums[b]
+            self.bookstarts[b] = total
+            self.bases.append(total)
+            self.chapoffsets.append(len(self.chapstarts))
+            self.chapstarts.extend(total + v for v in vbk)
+            self.numchaps.append(len(vbk) - 1)
+            total += vbk[-1]
+        self.total = total
+        self._tables = None
+
+    def _reverse(self):
+        ''' Returns the book index, chapter and verse of every ordinal '''
+        if self._tables is None:
+            bks, chaps, vss = [], [], []
+            for i, b in enumerate(self.order):
+                vbk = self.vrs.vnums[b]
+                for c in range(1, len(vbk)):
+                    n = vbk[c] - vbk[c-1]
+                    bks.extend([i] * n)
+                    chaps.extend([c] * n)
+                    vss.extend(range(1, n + 1))
+            if np is not None:
+                bks, chaps, vss = (np.array(x, dtype=np.int32) for x in (bks, chaps, vss))
+            self._tables = (bks, chaps, vss)
+        return self._tables
+
+    def ordinal(self, ref):
+        ''' Returns the ordinal of the first verse of a Ref, which must be in
+            the versification '''
+        i = self.bookindex.get(ref.book, None)
+        if i is None:
+            raise ValueError(f"{ref.book} not in versification")
+        off = self.chapoffsets[i]
+        if ref.chapter is None:
+            return self.chapstarts[off]
+        n = self.numchaps[i]
+        c = n if ref.chapter < 0 else ref.chapter
+        if not 0 < c <= n:
+            raise ValueError(f"{ref} chapter not in versification")
+        if ref.verse is None:
+            return self.chapstarts[off+c-1]
+        start = self.chapstarts[off+c-1]
+        nv = self.chapstarts[off+c] - start
+        v = nv if ref.verse < 0 else ref.verse
+        if not 0 < v <= nv:
+            raise ValueError(f"{ref} verse not in versification")
+        return start + v - 1
+
+    def span(self, ref):
+        ''' Returns the [start, end) ordinals of all the verses in a Ref,
+            clamping out of range chapters and verses '''
+        vbk = self.vrs[ref.book]
+        if vbk is None or ref.book not in self.bookstarts:
+            raise ValueError(f"{ref.book} not in versification")
+        base = self.bookstarts[ref.book]
+        if ref.chapter is None:
+            return (base, base + vbk[-1])
+        c = len(vbk) - 1 if ref.chapter < 0 else min(max(ref.chapter, 1), len(vbk) - 1)
+        if ref.verse is None:
+            return (base + vbk[c-1], base + vbk[c])
+        n = vbk[c] - vbk[c-1]
+        v = n if ref.verse < 0 else min(max(ref.verse, 1), n)
+        return (base + vbk[c-1] + v - 1, base + vbk[c-1] + v)
+
+    def ref(self, o, factory=None):
+        ''' Returns the verse Ref for an ordinal '''
+        if not 0 <= o < self.total:
+            raise IndexError(f"Verse ordinal {o} out of range")
+        if factory is None:
+            from usfmtc.reference import Ref as factory
+        bks, chaps, vss = self._reverse()
+        return factory(book=self.order[bks[o]], chapter=int(chaps[o]), verse=int(vss[o]))
+
+    def bookof(self, o):
+        ''' Returns the book of an ordinal '''
+        return self.order[bisect_right(self.bases, o) - 1]
+
+    def _bookindices(self, bks):
+        if np is not None and isinstance(bks, np.ndarray) and bks.dtype.kind in "iu":
+            return bks
+        return [b if isinstance(b, int) else self.bookindex.get(b, -1) for b in bks]
+
+    def valid(self, bks, chaps, verses):
+        ''' Returns whether each (book, chapter, verse) is a verse in the
+            versification. Books are codes or indices into order. '''
+        bks = self._bookindices(bks)
+        if np is not None:
+            bks = np.asarray(bks, dtype=np.int64)
+            chaps = np.asarray(chaps, dtype=np.int64)
+            verses = np.asarray(verses, dtype=np.int64)
+            offs = np.array(self.chapoffsets, dtype=np.int64)
+            starts = np.array(self.chapstarts, dtype=np.int64)
+            okbk = (bks >= 0) & (bks < len(self.order))
+            b = np.where(okbk, bks, 0)
+            okch = okbk & (chaps > 0) & (chaps <= np.array(self.numchaps, dtype=np.int64)[b])
+            ci = np.where(okch, offs[b] + chaps, 1)
+            return okch & (verses > 0) & (verses <= starts[ci] - starts[ci-1])
+        res = []
+        for b, c, v in zip(bks, chaps, verses):
+            if not 0 <= b < len(self.order):
+                res.append(False)
+                continue
+            vbk = self.vrs.vnums[self.order[b]]
+            res.append(0 < c < len(vbk) and 0 < v <= vbk[c] - vbk[c-1])
+        return res
+
+    def ordinals(self, bks, chaps, verses):
+        ''' Returns the ordinal of each (book, chapter, verse), which must all
+            be valid. Books are codes or indices into order. '''
+        bks = self._bookindices(bks)
+        if np is not None:
+            offs = np.array(self.chapoffsets, dtype=np.int64)
+            starts = np.array(self.chapstarts, dtype=np.int64)
+            return starts[offs[np.asarray(bks, dtype=np.int64)] + np.asarray(chaps, dtype=np.int64) - 1] \
+                        + np.asarray(verses, dtype=np.int64) - 1
+        return [self.chapstarts[self.chapoffsets[b] + c - 1] + v - 1 for b, c, v in zip(bks, chaps, verses)]
+
+    def expand(self, starts, ends):
+        ''' Returns one array of all the ordinals in each [start, end) range '''
+        if np is not None:
+            starts = np.asarray(starts, dtype=np.int64)
+            lens = np.asarray(ends, dtype=np.int64) - starts
+            lens = np.maximum(lens, 0)
+            offs = np.cumsum(lens) - lens
+            return np.arange(lens.sum()) - np.repeat(offs - starts, lens)
+        return [o for s, e in zip(starts, ends) for o in range(s, e)]
+
+    def refs(self, ords, factory=None):
+        ''' Yields the verse Ref for each ordinal, making each only when needed '''
+        if factory is None:
+            from usfmtc.reference import Ref as factory
+        bks, chaps, vss = self._reverse()
+        vrs = None if self.vrs is factory._defvrs else self.vrs
+        for o in ords:
+            yield factory._newverse(self.order[bks[o]], int(chaps[o]), int(vss[o]), vrs)
+
+    def locate(self, ords):
+        ''' Returns arrays of the book index, chapter and verse of each ordinal '''
+        bks, chaps, vss = self._reverse()
+        if np is not None:
+            ords = np.asarray(ords, dtype=np.int64)
+            return bks[ords], chaps[ords], vss[ords]
+        return [bks[o] for o in ords], [chaps[o] for o in ords], [vss[o] for o in ords]
+
 class Versification:
 
-    def __init__(self, fname=None):
+    def __init__(self, fname=None, compiled=True):
         self.toorg = {}         # mappings to org (canonical references)
         self.fromorg = {}       # mappings from org
         self.vnums = {}         # list of verse index to the start of each chapter keyed by book
         self.segments = {}
         self.exclusions = set()
         self.name = None
+        self._ordinals = None
         if fname is not None:
-            self.readFile(fname)
+            if compiled and isinstance(fname, str) and os.path.isfile(fname):
+                if not self.readCompiled(fname):
+                    self.readFile(fname)
+                    self.writeCompiled(fname)
+            else:
+                self.readFile(fname)
 
     def __getitem__(self, bk):
         return self.vnums.get(bk, None)
 
+    def getordinals(self):
+        ''' Returns the VerseOrdinals for this versification '''
+        if self._ordinals is None:
+            self._ordinals = VerseOrdinals(self)
+        return self._ordinals
+
     def readFile(self, fname):
         from usfmtc.reference import Ref, books
         logger.debug(f"versification readFile({fname})")
@@ -81,6 +340,91 @@ class Versification:
                 verses = [int(x.split(':')[1]) for x in b[1:]]
                 versesums = reduce(lambda a, x: (a[0] + [a[1]+x], a[1]+x), verses, ([0], 0))
                 self.vnums[b[0]] = versesums[0]
+                self._ordinals = None
+
+    def writeCompiled(self, fname, outpath=None):
+        ''' Saves a compiled binary form of this versification, as read from
+            fname, for readCompiled. Returns the path written or None on failure. '''
+        if outpath is None:
+            outpath = compiled_path(fname)
+        try:
+            st = os.stat(fname)
+            w = _BinWriter()
+            w.str(self.name)
+            w.int(len(self.vnums))
+            for k, v in self.vnums.items():
+                w.str(k)
+                w.int(len(v))
+                w.dat += struct.pack(f"<{len(v)}i", *v)
+            for mapping in (self.toorg, self.fromorg):
+                w.int(len(mapping))
+                for k, v in mapping.items():
+                    w.str(k)
+                    w.ref(v)
+            w.int(len(self.exclusions))
+            for e in sorted(self.exclusions):
+                w.str(e)
+            w.int(len(self.segments))
+            for k, v in self.segments.items():
+                w.str(k)
+                w.int(len(v))
+                for s in v:
+                    w.str(s)
+            os.makedirs(os.path.dirname(outpath), exist_ok=True)
+            tmppath = f"{outpath}.{os.getpid()}.tmp"
+            with open(tmppath, "wb") as outf:
+                outf.write(struct.pack("<8sqq", _vrsmagic, st.st_mtime_ns, st.st_size))
+                outf.write(w.dat)
+            os.replace(tmppath, outpath)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Failed to write compiled versification for {fname}: {e}")
+            return None
+        return outpath
+
+    def readCompiled(self, fname, inpath=None):
+        ''' Loads the compiled form of fname if there is an up to date one.
+            This skips parsing the text but still makes each mapping's Ref,
+            so it takes about a third of the time of readFile. Returns True
+            on success. '''
+        if inpath is None:
+            inpath = compiled_path(fname)
+        try:
+            st = os.stat(fname)
+            with open(inpath, "rb") as inf, mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, mtime, size = struct.unpack_from("<8sqq", mm, 0)
+                if magic != _vrsmagic or mtime != st.st_mtime_ns or size != st.st_size:
+                    return False
+                r = _BinReader(mm, struct.calcsize("<8sqq"))
+                name = r.str()
+                vnums = {}
+                for i in range(r.int()):
+                    k = r.str()
+                    vnums[k] = r.ints(r.int())
+                mappings = []
+                for j in range(2):
+                    mapping = {}
+                    for i in range(r.int()):
+                        k = r.str()
+                        mapping[k] = r.ref(self)
+                    mappings.append(mapping)
+                exclusions = set(r.str() for i in range(r.int()))
+                segments = {}
+                for i in range(r.int()):
+                    k = r.str()
+                    segments[k] = [r.str() for j in range(r.int())]
+        except (OSError, ValueError, struct.error) as e:
+            logger.debug(f"No compiled versification for {fname}: {e}")
+            return False
+        self.name = name
+        self.vnums = vnums
+        self._ordinals = None
+        self.toorg, self.fromorg = mappings
+        self.exclusions = exclusions
+        self.segments = segments
+        from usfmtc.reference import Ref
+        if Ref.versification is None:       # as parsing refs in readFile would
+            Ref.loadversification()
+        return True
 
     def _addOneMapping(self, mapping, left, right):
         if str(left) in mapping:
@@ -149,9 +493,83 @@ class Versification:
         return True
 
 
-def main():
-    import argparse, os, sys
+class VersificationPair:
+    ''' A precomposed mapping from one versification to another (or to org if
+        tgt is None). Gives the same results as src.remap(ref, tgt) but with a
+        single lookup per reference. '''
+
+    def __init__(self, src, tgt):
+        self.src = src
+        self.tgt = tgt
+        self.same = tgt is not None and src.issame_map(tgt)
+        self.forward = self._compose(reverse=False)
+        self.backward = self._compose(reverse=True)
+
+    def _compose(self, reverse=False):
+        from usfmtc.reference import Ref
+        toorg = self.src.fromorg if reverse else self.src.toorg
+        if self.tgt is None:
+            return dict(toorg)
+        otoorg = self.tgt.fromorg if reverse else self.tgt.toorg
+        ofromorg = self.tgt.toorg if reverse else self.tgt.fromorg
+        keys = set(toorg) | set(otoorg) | set(k for k in ofromorg if k.startswith("ESG"))
+        res = {}
+        for k in keys:
+            ref = Ref(k)
+            orgref = toorg.get(k, ref)
+            oorgref = otoorg.get(k, ref)
+            if ref.book != "ESG" and orgref == oorgref:
+                continue            # maps to itself
+            res[k] = ofromorg.get(str(orgref), orgref)
+        return res
+
+    def remap(self, ref, reverse=False):
+        ''' maps a reference from src to tgt, or tgt to src if reverse is set '''
+        if isinstance(ref, RefRange):
+            first = self.remap(ref.first, reverse=reverse)
+            last = self.remap(ref.last, reverse=reverse)
+            return RefRange(first, last)
+        mapping = self.backward if reverse else self.forward
+        res = mapping.get(str(ref), ref).copy()
+        res.versification = self.src if self.tgt is None else self.tgt
+        return res
+
+
+def _loadvrs(fname):
+    if fname is None:
+        return None
+    if fname not in versifications:
+        versifications[fname] = Versification(fname)
+    return versifications[fname]
+
+_jobvrs = (None, None)
+
+def _initjobs(frompath, topath):
+    """ Loads the versifications and their composed mapping once per worker """
+    global _jobvrs
+    _jobvrs = (_loadvrs(frompath), _loadvrs(topath))
+    if _jobvrs[0] is not None:
+        cached_pair(*_jobvrs)
+    elif _jobvrs[1] is not None:
+        cached_pair(_jobvrs[1], None)
+
+def _reversifyjob(infile, outfile, keep=False, chnums=False):
+    """ Reversifies one file, returning (infile, seconds taken, error or None) """
+    import time
     from usfmtc import readFile
+    start = time.time()
+    try:
+        usx = readFile(infile)
+        usx.reversify(*_jobvrs, keep=keep, chnums=chnums)
+        usx.saveAs(outfile)
+    except Exception as e:
+        logger.debug("".join(traceback.format_exc()))
+        return (infile, time.time() - start, f"{type(e).__name__}: {e}")
+    return (infile, time.time() - start, None)
+
+def main():
+    import argparse, os, sys, time
+    from concurrent.futures import ProcessPoolExecutor, as_completed
 
     parser = argparse.ArgumentParser()
     parser.add_argument("infile", nargs="+", help="Input files or directory")
@@ -160,11 +578,12 @@ def main():
     parser.add_argument("-t", "--to", help="to versification file")
     parser.add_argument("-k", "--keep", action="store_true", help="Add vp for change verse numbers")
     parser.add_argument("-C", "--withcnums", action="store_true", help="with --keep include chapter numbers if different")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of books to process in parallel")
+    parser.add_argument("-T", "--timing", action="store_true", help="Report the time taken for each book")
     args = parser.parse_args()
 
     argfr = getattr(args, 'from', None)
-    fromv = Versification(argfr) if argfr is not None else None
-    tov = Versification(args.to) if args.to is not None else None
+    _initjobs(argfr, args.to)       # composed once, inherited or reloaded by each worker
 
     infiles = []
     for inf in args.infile:
@@ -185,10 +604,26 @@ def main():
         for inf in infiles:
             jobs.append((inf, os.path.join(args.outfile, os.path.basename(inf))))
 
-    for j in jobs:
-        usx = readFile(j[0])
-        usx.reversify(fromv, tov, keep=args.keep, chnums=args.withcnums)
-        usx.saveAs(j[1])
+    start = time.time()
+    kw = dict(keep=args.keep, chnums=args.withcnums)
+    if args.jobs > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=_initjobs,
+                                 initargs=(argfr, args.to)) as pool:
+            futures = [pool.submit(_reversifyjob, *j, **kw) for j in jobs]
+            results = [f.result() for f in as_completed(futures)]
+    else:
+        results = [_reversifyjob(*j, **kw) for j in jobs]
+
+    errors = [r for r in results if r[2] is not None]
+    if args.timing:
+        for r in sorted(results, key=lambda x: -x[1]):
+            print(f"{r[1]:8.3f}s {r[0]}{' (failed)' if r[2] else ''}")
+        print(f"{time.time() - start:8.3f}s total for {len(results)} books")
+    if len(errors):
+        print(f"{len(errors)} of {len(results)} books failed:")
+        for r in sorted(errors):
+            print(f"    {r[0]}: {r[2]}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -10,10 +10,75 @@ class ParentElement(et.Element):
         self.parent = parent
         self.pos = pos
 
+    def invalidate(self):
+        ''' Clears any cached content hashes of this element and its ancestors.
+            Called by mutating methods and, once an element has cached hashes,
+            on setting its text, tail, tag or attrib. Only needs calling after
+            changing attrib[...] directly. '''
+        e = self
+        while e is not None and e.__dict__.get('_hashes', None) is not None:
+            e._hashes = None
+            e = getattr(e, 'parent', None)
+
+    def cachehash(self, key, value):
+        ''' Caches a content hash (see usxmodel.ethash) until the next change '''
+        cls = self.__class__
+        if not issubclass(cls, _HashedElement):
+            hcls = _hashedclasses.get(cls, None)
+            if hcls is None:
+                hcls = _hashedclasses[cls] = type(cls.__name__, (_HashedElement, cls), {})
+            self.__class__ = hcls
+        hashes = self.__dict__.get('_hashes', None)
+        if hashes is None:
+            hashes = self._hashes = {}
+        hashes[key] = value
+
+    def _adopt(self, e):
+        e.parent = self             # so that changes to e invalidate its new ancestors
+
     def append(self, e):
         super().append(e)
-        if e.parent is None:
-            e.parent = self         # capture the hiearchy when coming from et.parse
+        self._adopt(e)
+        self.invalidate()
+
+    def extend(self, elements):
+        elements = list(elements)
+        super().extend(elements)
+        for e in elements:
+            self._adopt(e)
+        self.invalidate()
+
+    def insert(self, i, e):
+        super().insert(i, e)
+        self._adopt(e)
+        self.invalidate()
+
+    def remove(self, e):
+        super().remove(e)
+        self.invalidate()
+
+    def clear(self):
+        super().clear()
+        self.invalidate()
+
+    def set(self, k, v):
+        super().set(k, v)
+        self.invalidate()
+
+    def __setitem__(self, i, e):
+        if isinstance(i, slice):
+            e = list(e)
+            super().__setitem__(i, e)
+            for c in e:
+                self._adopt(c)
+        else:
+            super().__setitem__(i, e)
+            self._adopt(e)
+        self.invalidate()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.invalidate()
 
     def makeelement(self, tag, attrib, pos=None):
         return self.__class__(tag, attrib, parent=self, pos=pos or self.pos)
@@ -33,7 +98,10 @@ class ParentElement(et.Element):
         res.tail = self.tail
         if children:
             for e in self:
-                res.append(e.copy(deep=deep, parent=res, factory=factory) if deep else e)
+                if deep:
+                    res.append(e.copy(deep=deep, parent=res, factory=factory))
+                else:
+                    et.Element.append(res, e)   # shared, so it keeps its parent
         return res
 
     def _getindex(self):
@@ -97,6 +165,44 @@ class ParentElement(et.Element):
         return self.parent
 
 
+_hashedclasses = {}
+
+class _HashedElement:
+    ''' Mixed into the class of an element once it caches a hash, so that only
+        those pay for invalidating on setting text, tail, tag or attrib. '''
+    __slots__ = ()
+
+    def __setattr__(self, k, v):
+        super().__setattr__(k, v)
+        if k in ("text", "tag", "attrib"):
+            self.invalidate()
+        elif k == "tail" and self.parent is not None:
+            self.parent.invalidate()    # tails are part of the parent's content
+
+def _srcsig(e):
+    return hash(tuple((c.tag, tuple(c.attrib.items()), c.text, c.tail, len(c)) for c in e.iter()))
+
+def marksources(root, length):
+    ''' Sets srcspan on each top level element of root to the (start, end) of
+        its source text, from the offset of its pos up to that of the next
+        element, or length for the last. A signature of each is kept too, so
+        that sourcespan can tell if it, its tail or its descendants change. '''
+    starts = [getattr(getattr(e, 'pos', None), 'offset', None) for e in root] + [length]
+    for i, e in enumerate(root):
+        s, n = starts[i], starts[i+1]
+        if s is None or n is None or n <= s:
+            continue
+        e.srcspan = (s, n)
+        e.srcsig = _srcsig(e)
+
+def sourcespan(e):
+    ''' Returns the srcspan of a top level element if it and its contents are
+        as they were when marksources was run on them, else None. '''
+    span = getattr(e, 'srcspan', None)
+    if span is None or _srcsig(e) != e.srcsig:
+        return None
+    return span
+
 def parsexml(infile):
     tb = et.TreeBuilder(element_factory=ParentElement)
     parser = et.XMLParser(target=tb)
@@ -104,6 +210,20 @@ def parsexml(infile):
     res.parse(infile, parser)
     return res
 
+class RangeElement(ParentElement):
+    """ An element of a range view of a document (see USXCursor.copy_range).
+        Its children may be elements of the original document, shared rather
+        than copied, so a view is read only. """
+
+    def _adopt(self, e):
+        if isinstance(e, RangeElement):
+            e.parent = self         # shared elements keep their parent in the document
+
+    def materialize(self, parent=None, factory=ParentElement):
+        """ Returns an independent deep copy of the view """
+        return self.copy(deep=True, parent=parent, factory=factory)
+
+
 def writexml(outf, root):
     outf.write('<?xml version="1.0" encoding="utf-8"?>\n')
     qnames, ns = et._namespaces(root, None)
@@ -158,6 +278,89 @@ def _serialize_xml(write, elem, qnames, namespaces, short_empty_elements, **kwar
     if elem.tail:
         write(usfmToUsxEscapes(elem.tail))
 
+_prettytags = ('para', 'sidebar', 'table', 'chapter', 'usx', 'book')
+
+class XMLWriter:
+    ''' Writes the XML of a tree to outf from the (event, element) pairs of a
+        walk of it, given to event() from the start of the root to its end. If
+        pretty, the output is as prettyxml then writexml would give, without
+        changing any tails. Writes are made in chunks of about bufsize.
+        Namespaced tags are not supported. '''
+
+    def __init__(self, outf, pretty=True, width=2, bufsize=65536):
+        self.outf = outf
+        self.pretty = pretty
+        self.width = width
+        self.bufsize = bufsize
+        self.buf = []
+        self.size = 0
+        self.indents = [""]     # indent of the children of each open element
+        self.last = None        # element whose tail is yet to be written
+        self.root = None
+
+    def _write(self, s):
+        self.buf.append(s)
+        self.size += len(s)
+        if self.size >= self.bufsize:
+            self.flush()
+
+    def flush(self):
+        if len(self.buf):
+            self.outf.write("".join(self.buf))
+            self.buf = []
+            self.size = 0
+
+    def event(self, ev, el):
+        ''' Writes the output for an event. Returns None '''
+        last = self.last
+        if ev == "start":
+            indent = self.indents[-1]
+            ispretty = self.pretty and el.tag in _prettytags
+            if last is not None:
+                self.last = None
+                if ispretty:
+                    s = usfmToUsxEscapes((last.tail or "").rstrip(WS)) + "\n" + indent + "<" + el.tag
+                elif last.tail:
+                    s = usfmToUsxEscapes(last.tail) + "<" + el.tag
+                else:
+                    s = "<" + el.tag
+            elif self.root is None:
+                self.root = el
+                s = '<?xml version="1.0" encoding="utf-8"?>\n<' + el.tag
+            else:
+                s = "<" + el.tag
+            self.indents.append(indent + " " * self.width if ispretty else indent)
+            for k, v in el.attrib.items():
+                if v is not None and not k.startswith(" "):
+                    s += ' %s="%s"' % (k, usfmToUsxEscapes(v))
+            if el.text:
+                s += ">" + usfmToUsxEscapes(el.text)
+            elif len(el):
+                s += ">"
+            else:
+                s += " />"
+        else:
+            if last is not None:
+                self.last = None
+                s = usfmToUsxEscapes(last.tail) if last.tail else ""
+            else:
+                s = ""
+            self.indents.pop()
+            if el.text or len(el):
+                s += "</" + el.tag + ">"
+            if el is self.root:
+                if el.tail:
+                    s += usfmToUsxEscapes(el.tail)
+                self._write(s + "\n")
+                self.flush()
+                self.root = None
+                return
+            self.last = el
+        self.buf.append(s)
+        self.size += len(s)
+        if self.size >= self.bufsize:
+            self.flush()
+
 def prettyxml(node, last=None, indent="", width=2):
     if node.tag in ('para', 'sidebar', 'table', 'chapter', 'usx', 'book'):
         if last is not None:
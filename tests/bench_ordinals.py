@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+''' Times expanding reference lists to their verses and validating many
+    references, one reference at a time against the bulk ordinal APIs. '''
+
+import time, argparse, random
+from usfmtc.reference import Ref, RefList
+
+def makerefs(num, seed=1):
+    rnd = random.Random(seed)
+    vrs = Ref.versification or Ref.loadversification()
+    bks = [b for b in ("GEN", "PSA", "ISA", "MAT", "ACT", "REV") if vrs[b] is not None]
+    res = RefList()
+    for i in range(num):
+        bk = rnd.choice(bks)
+        c = rnd.randint(1, len(vrs[bk]))      # sometimes one chapter too many
+        res.append(Ref(book=bk, chapter=c, verse=rnd.randint(1, 30)))
+    return res
+
+def timeit(fn, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repeat each timing")
+    args = parser.parse_args()
+
+    vrs = Ref.versification or Ref.loadversification()
+    for bk, chaps in (("PSA", (119, 119)), ("PSA", (1, 150)), ("ISA", (1, 66))):
+        s = "{} {}:1-{}:{}".format(bk, chaps[0], chaps[1], vrs[bk][chaps[1]] - vrs[bk][chaps[1]-1])
+        refs = RefList(s)
+        num = len(refs.ordinals())
+        t = timeit(lambda: [x for r in refs for x in r], args.repeat)
+        print(f"{s:16s} {num:6d} verses iterate   {t*1000:9.2f}ms")
+        t = timeit(lambda: refs.ordinals(), args.repeat)
+        print(f"{s:16s} {num:6d} verses ordinals  {t*1000:9.2f}ms")
+        t = timeit(lambda: list(refs.allverses()), args.repeat)
+        print(f"{s:16s} {num:6d} verses allverses {t*1000:9.2f}ms")
+    for num in (10000, 100000):
+        refs = makerefs(num)
+        t = timeit(lambda: [r.isvalid() for r in refs], args.repeat)
+        print(f"{num:6d} refs isvalid   {t*1000:9.2f}ms")
+        t = timeit(lambda: refs.validmask(), args.repeat)
+        print(f"{num:6d} refs validmask {t*1000:9.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+''' Times parsing one long reference list string, and many short reference
+    strings with RefList.parse_many, for increasing numbers of references.
+    Time per reference should stay roughly flat. '''
+
+import time, argparse, random
+from usfmtc.reference import RefList
+
+def makerefs(num, seed=1):
+    rnd = random.Random(seed)
+    res = []
+    for i in range(num):
+        s = "{} {}:{}".format(rnd.choice(["GEN", "EXO", "PSA", "MAT", "JHN", "ROM"]),
+                              rnd.randint(1, 20), rnd.randint(1, 30))
+        if rnd.random() < 0.3:
+            s += "-{}".format(rnd.randint(31, 40))
+        res.append(s)
+    return res
+
+def timeit(fn, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repeat each timing")
+    args = parser.parse_args()
+
+    for num in (1000, 4000, 16000, 64000):
+        refs = makerefs(num)
+        s = "; ".join(refs)
+        best = timeit(lambda: RefList(s), args.repeat)
+        print(f"{num:6d} refs in one string {best*1000:9.2f}ms {best*1e6/num:7.1f}us/ref")
+        best = timeit(lambda: RefList.parse_many(refs), args.repeat)
+        print(f"{num:6d} refs parse_many    {best*1000:9.2f}ms {best*1e6/num:7.1f}us/ref")
+
+if __name__ == "__main__":
+    main()
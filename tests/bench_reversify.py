@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+''' Times reversifying a generated Psalms from eng to org for increasing
+    numbers of chapters. Time per chapter should stay roughly flat. '''
+
+import time, argparse
+from usfmtc import readFile
+from usfmtc.versification import cached_versification
+
+def makepsalms(vrs, numchaps):
+    vnums = vrs["PSA"]
+    res = [r"\id PSA Generated Psalms"]
+    for c in range(1, numchaps + 1):
+        res.append(rf"\c {c}")
+        res.append(r"\s1 Section heading")
+        for v in range(1, vnums[c] - vnums[c-1] + 1):
+            if v % 2:
+                res.append(r"\q1")
+            res.append(rf"\v {v} Text of psalm {c} verse {v}.")
+    return "\n".join(res) + "\n"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repeat each timing")
+    args = parser.parse_args()
+
+    engvrs = cached_versification("eng")
+    for numchaps in (25, 50, 100, 150):
+        usfm = makepsalms(engvrs, numchaps)
+        best = None
+        for i in range(args.repeat):
+            usx = readFile(usfm, informat="usfm")
+            start = time.perf_counter()
+            usx.reversify(engvrs, None)
+            t = time.perf_counter() - start
+            best = t if best is None else min(best, t)
+        print(f"{numchaps:4d} chapters {best*1000:9.2f}ms {best*1e6/numchaps:9.1f}us/chapter")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+''' Times saving a generated book as USX, USJ and USFM with a saveAs for each
+    against one saveAll, and reports the throughput. '''
+
+import time, argparse, os, tempfile
+from usfmtc import readFile
+from bench_usj import makebook
+
+def separate(doc, outputs):
+    for p in outputs:
+        doc.saveAs(p)
+
+def together(doc, outputs):
+    doc.saveAll(outputs)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repeat each timing")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    outputs = {os.path.join(tmpdir, "out" + e): None for e in (".usx", ".json", ".usfm")}
+    for numchaps in (50, 150, 400):
+        doc = readFile(makebook(numchaps), informat="usfm")
+        for name, fn in (("saveAs", separate), ("saveAll", together)):
+            best = None
+            for i in range(args.repeat):
+                start = time.perf_counter()
+                fn(doc, outputs)
+                t = time.perf_counter() - start
+                best = t if best is None else min(best, t)
+            size = sum(os.path.getsize(p) for p in outputs)
+            print(f"{numchaps:4d} chapters {name:8s} {best*1000:9.2f}ms {size/best/1e6:8.2f}MB/s")
+    for p in outputs:
+        os.remove(p)
+    os.rmdir(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+''' Times RefList.simplify on random lists of verses and verse ranges of
+    increasing length. Time per reference should stay roughly flat. '''
+
+import time, argparse, random
+from usfmtc.reference import Ref, RefRange, RefList
+from usfmtc.refset import _getordinals
+
+def makerefs(ords, num):
+    res = []
+    for i in range(num):
+        s = random.randrange(ords.total - 40)
+        first = ords.ref(s)
+        last = ords.ref(s + random.randint(1, 10))
+        if random.random() < 0.3 and first.book == last.book:
+            res.append(RefRange(first, last))
+        else:
+            res.append(first)
+    return res
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repeat each timing")
+    parser.add_argument("-s", "--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    ords = _getordinals(None)
+    for num in (1000, 10000, 100000, 300000):
+        refs = makerefs(ords, num)
+        best = None
+        for i in range(args.repeat):
+            rl = RefList([r.copy() for r in refs])
+            start = time.perf_counter()
+            rl.simplify()
+            t = time.perf_counter() - start
+            best = t if best is None else min(best, t)
+        print(f"{num:7d} refs -> {len(rl):7d} {best*1000:9.2f}ms {best*1e6/num:7.2f}us/ref")
+
+if __name__ == "__main__":
+    main()
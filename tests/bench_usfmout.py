@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+''' Times writing a generated book as USFM to a file, buffering the output
+    against writing each fragment as it is made, and against copying all but
+    one edited paragraph from the source, and reports the throughput. '''
+
+import time, argparse, os, tempfile
+from usfmtc import readFile
+from usfmtc.usfmgenerate import usx2usfm, Emitter
+from bench_usj import makebook
+
+def unbuffered(outf, escapes, **kw):
+    return Emitter(outf, escapes, bufsize=0, **kw)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repeat each timing")
+    args = parser.parse_args()
+
+    fd, fname = tempfile.mkstemp(suffix=".usfm")
+    os.close(fd)
+    for numchaps in (50, 150, 400):
+        doc = readFile(makebook(numchaps), informat="usfm")
+        srcdoc = readFile(makebook(numchaps), informat="usfm", keepsource=True)
+        srcdoc.getroot().find(".//verse").tail += " edited"
+        for name, emitter, source in (("buffered", Emitter, None), ("unbuffered", unbuffered, None),
+                                      ("source", Emitter, srcdoc.source)):
+            root = doc.getroot() if source is None else srcdoc.getroot()
+            best = None
+            for i in range(args.repeat):
+                with open(fname, "w", encoding="utf-8") as outf:
+                    start = time.perf_counter()
+                    usx2usfm(outf, root, doc.grammar, emitter=emitter, source=source)
+                    t = time.perf_counter() - start
+                best = t if best is None else min(best, t)
+            size = os.path.getsize(fname)
+            print(f"{numchaps:4d} chapters {name:10s} {best*1000:9.2f}ms {size/best/1e6:8.2f}MB/s")
+    os.remove(fname)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+''' Times writing USJ by building the dicts and dumping them against writing
+    it while walking the tree, and compares the peak memory used. Then does
+    the same for converting USFM to USJ via a USX tree against converting it
+    directly as it is parsed. '''
+
+import time, argparse, json, tracemalloc
+from usfmtc import readFile
+from usfmtc.usjproc import usxtousj, writeusj, usfmtousj
+
+def makebook(numchaps):
+    res = [r"\id PSA Generated book", r"\h Generated", r"\mt1 Generated book"]
+    for c in range(1, numchaps + 1):
+        res.append(rf"\c {c}")
+        res.append(r"\s1 Section heading")
+        for v in range(1, 31):
+            if v % 5 == 1:
+                res.append(r"\p")
+            res.append(rf"\v {v} Text of chapter {c} verse {v} with \w a word|lemma=\w* and"
+                       rf" a note\f + \fr {c}:{v} \ft The note text.\f* in it.")
+    return "\n".join(res) + "\n"
+
+class Sink:
+    ''' Counts what is written to it '''
+    def __init__(self):
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s)
+
+def dumps(root, indent):
+    outf = Sink()
+    outf.write(json.dumps(usxtousj(root), indent=indent, ensure_ascii=False,
+                          separators=(",", ":") if indent is None else None))
+    return outf
+
+def stream(root, indent):
+    outf = Sink()
+    writeusj(outf, root, indent=indent)
+    return outf
+
+def viatree(usfm, indent):
+    outf = Sink()
+    writeusj(outf, readFile(usfm, informat="usfm").getroot(), indent=indent)
+    return outf
+
+def direct(usfm, indent):
+    outf = Sink()
+    usfmtousj(outf, usfm, indent=indent)
+    return outf
+
+def measure(fn, src, indent, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(src, indent)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    tracemalloc.start()
+    fn(src, indent)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repeat each timing")
+    args = parser.parse_args()
+
+    for numchaps in (50, 150, 400):
+        usfm = makebook(numchaps)
+        root = readFile(usfm, informat="usfm").getroot()
+        for indent in (2, None):
+            for name, fn, src in (("dumps", dumps, root), ("stream", stream, root),
+                                  ("viatree", viatree, usfm), ("direct", direct, usfm)):
+                t, peak = measure(fn, src, indent, args.repeat)
+                print(f"{numchaps:4d} chapters indent={indent!s:4s} {name:7s} {t*1000:9.2f}ms"
+                      f" {peak/1e6:8.2f}MB peak")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+''' Times reading USJ with json.loads and usjtousx against reading it
+    incrementally with readusj, and compares the peak memory used. '''
+
+import time, argparse, json, os, tempfile, tracemalloc
+from usfmtc import readFile
+from usfmtc.usjproc import usjtousx, readusj
+from bench_usj import makebook
+
+def loads(fname):
+    with open(fname, encoding="utf-8") as inf:
+        return usjtousx(json.loads(inf.read()))
+
+def stream(fname):
+    return readusj(fname, pure=True)
+
+def measure(fn, fname, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(fname)
+        t = time.perf_counter() - start
+        best = t if best is None else min(best, t)
+    tracemalloc.start()
+    fn(fname)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Repeat each timing")
+    args = parser.parse_args()
+
+    fd, fname = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    for numchaps in (50, 150, 400):
+        with open(fname, "w", encoding="utf-8") as outf:
+            json.dump(readFile(makebook(numchaps), informat="usfm").outUsj(None), outf, indent=2)
+        for name, fn in (("loads", loads), ("stream", stream)):
+            t, peak = measure(fn, fname, args.repeat)
+            print(f"{numchaps:4d} chapters {name:6s} {t*1000:9.2f}ms {peak/1e6:8.2f}MB peak")
+    os.remove(fname)
+
+if __name__ == "__main__":
+    main()
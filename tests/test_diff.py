@@ -0,0 +1,39 @@
+import pytest
+from pytest import fail
+import usfmtc
+from usfmtc.usxmodel import etCmp
+import os
+
+jon = usfmtc.readFile(os.path.join(os.path.dirname(__file__), "32JONBSB.usfm"))
+
+def _edited():
+    res = jon.copy(deep=True)
+    root = res.getroot()
+    for v in root.iter("verse"):
+        if v.get("number") == "3" and v.tail and "Jonah" in v.tail:
+            v.tail = v.tail.replace("Jonah", "Jonas")
+            break
+    chaps = [i for i, e in enumerate(root) if e.tag == "chapter"]
+    del root[chaps[2] + 2]                       # lose a paragraph in chapter 3
+    p = root[chaps[3] + 2].copy(deep=True, parent=root)
+    root.insert(chaps[3] + 2, p)                 # duplicate one in chapter 4
+    return res
+
+def test_diffsame():
+    ops = usfmtc.diff(jon, jon.copy(deep=True))
+    if len(ops):
+        fail(f"Identical documents give {ops}")
+
+def test_diffpatch():
+    edited = _edited()
+    ops = usfmtc.diff(jon, edited)
+    if sorted(set(o.chapter for o in ops)) != [1, 3, 4]:
+        fail(f"Expected changes in chapters 1, 3 and 4, got {[(o.op, o.chapter, o.verses) for o in ops]}")
+    if not any("JON 1:3" in o.verses for o in ops):
+        fail(f"Failed to report JON 1:3 as changed in {[o.verses for o in ops]}")
+    res = usfmtc.patch(jon.copy(deep=True), ops)
+    if not etCmp(res.getroot(), edited.getroot(), verbose=True):
+        fail("Patched document differs from the edited one")
+    back = usfmtc.patch(edited.copy(deep=True), usfmtc.diff(edited, jon))
+    if not etCmp(back.getroot(), jon.getroot(), verbose=True):
+        fail("Reverse patched document differs from the original")
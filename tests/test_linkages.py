@@ -59,8 +59,7 @@ def test_link_simple():
     _dotest(usfm, { ("a001", "comment"): "JHN 3:7!3",
                     ("a002", "comment"): "JHN 3:7!4+2-6+2"})
 
-def test_link_romani():
-    usfm = r"""\id JHN John test
+romani = r"""\id JHN John test
 \c 2
 \p
 \v 24 \za|6ffadcab\*\za|1762aaba\*\za|77934015\*Atunći von phende \za-s|b596c2a4\*maśkar
@@ -73,7 +72,9 @@ def test_link_romani():
       maśkar \za-s|90fbe824\*penθe\za-e|90fbe824\* xulavde,\za|8206cdd4\*\qt*
 \q2 \qt \za-s|afcccf77\*haj\za-e|afcccf77\*Mirro gad// kasqe perel, von dikhle.}\qt*\x + \xo 19:24 \xt Psa 22:18.\xt*\x*
 \m \za-s|9deaa4bd\*Kadja\za-e|9deaa4bd\* vi kerde ol soldaturǎ."""
-    _dotest(usfm, {
+
+def test_link_romani():
+    _dotest(romani, {
                 ("77934015", "unk"): "JHN 2:24!0",
                 ("1762aaba", "unk"): "JHN 2:24!0",
                 ("6ffadcab", "unk"): "JHN 2:24!0",
@@ -97,6 +98,32 @@ def test_link_romani():
                 ("9deaa4bd", "unk"): "JHN 2:24!m!1",
                   }, skipsfmequal=True)
 
+def _mslinks(txt, batched):
+    from usfmtc.usxcursor import USXCursor
+    from usfmtc.usxmodel import _insertoblink
+    doc = readFile(txt, informat="usfm", grammar=grammar)
+    doc.canonicalise()
+    mlinks = []
+    for k, v in getlinkages(doc).items():
+        if v.first != v.last or v.getword(None) is None or v.getchar(None) is None:
+            mlinks.append((v.first, "za-s", False, k[0], k[1]))
+            mlinks.append((v.last, "za-e", True, k[0], k[1]))
+        else:
+            mlinks.append((v.first, "za", False, k[0], k[1]))
+    if batched:
+        insertlinkages(doc, mlinks)
+    else:
+        skiptest = lambda e:e.tag=="ms" and e.get("style","").startswith("za")
+        for l in mlinks:
+            _insertoblink(USXCursor.fromRef(l[0], doc, atend=l[2], skiptest=skiptest), l[1], l)
+    return asusfm(doc.getroot(), grammar)
+
+def test_link_batched():
+    seq = _mslinks(romani, False)
+    res = _mslinks(romani, True)
+    if res != seq:
+        fail(f"{res}\n is not the same as inserting each link in turn\n{seq}")
+
 def test_link_note():
     usfm = r"""\id JHN notes
 \c 17
@@ -165,3 +192,20 @@ def test_getrefspsa():
     if "\\d" not in f:
         fail(f"Missing \\d in {f}")
 
+
+def test_link_table():
+    from usfmtc.usxmodel import getlinkagetable
+    usfm = r"""\id JHN A test of John
+\c 3
+\p
+\v 7 This is \za-s|aid="a001" type="comment"\*the\za-e|aid="a001" type="comment"\*
+     bo\za-s|aid="a002" type="comment"\*ok to re\za-e|aid="a002" type="comment"\*ad"""
+    doc = readFile(usfm, informat="usfm", grammar=grammar)
+    doc.canonicalise()
+    table = getlinkagetable(doc)
+    if table.aids != ["a001", "a002"] or table.types != ["comment", "comment"]:
+        fail(f"Linkage table has {table.aids} {table.types}")
+    if any(e.tag == "ms" for e in doc.getroot().iter()):
+        fail("Alignment milestones left in the text")
+    if "This is the book to read" not in " ".join("".join(doc.getroot().itertext()).split()):
+        fail(f"Text not rejoined: {''.join(doc.getroot().itertext())}")
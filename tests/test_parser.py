@@ -336,3 +336,207 @@ def test_vid():
     doc, f = _dousfm(usfm, nofail=True)
     if 'vid' not in f:
         fail(f"vid lost in round tripping:\n{f}")
+
+def test_normalise():
+    from usfmtc.usfmparser import USFMParser
+    from usfmtc.usxmodel import cleanup, canonicalise, normalise
+    from usfmtc.xmlutils import ParentElement
+    usfm = r"""\id GEN Normalising test
+\c 1
+\p
+\v 1 Text~with \\ escapes\f + \fr 1.1 \ft note \xt Gen 1:1|href="GEN 1:1"\xt* text\f* and\x - \xo 1.1 \xt John 3:16|href="JHN 3:16"\xt*\x*  
+\v 2   spaced    out &amp; \fig A picture|src="a.jpg" size="col"\fig*   
+\tr \th1 Head \tc1-2 Cell
+\q1 \v 3 More \w word|lemma="a\|b"\w* text \f + note text \fq quoted\f*
+\p
+"""
+    for version in ("3.0", "3.1"):
+        seq = USFMParser(usfm, factory=ParentElement).parse()
+        cleanup(seq)
+        canonicalise(seq, version=version)
+        fused = USFMParser(usfm, factory=ParentElement).parse()
+        normalise(fused, version=version)
+        a, b = et.tostring(seq, encoding="unicode"), et.tostring(fused, encoding="unicode")
+        if a != b:
+            fail(f"Fused normalisation differs for {version}:\n{a}\n{b}")
+
+def test_hashes():
+    import os
+    jon = usfmtc.readFile(os.path.join(os.path.dirname(__file__), "32JONBSB.usfm"))
+    jonx = usfmtc.readFile(jon.outUsx(None), informat="usx")
+    jonj = usfmtc.readFile(json.dumps(jon.outUsj(None)), informat="usj")
+    if jon.contenthash() != jonx.contenthash() or jon.contenthash() != jonj.contenthash():
+        fail("Round tripped Jonah hashes differently")
+    if len(jonx.changedchapters(jon)):
+        fail(f"Round tripped Jonah has changed chapters {jonx.changedchapters(jon)}")
+    for v in jonx.getroot().iter("verse"):
+        if v.get("number") == "3" and v.tail and "Jonah" in v.tail:
+            v.tail = v.tail.replace("Jonah", "Jonas")
+            break
+    changed = jonx.changedchapters(jon)
+    if len(changed) != 1 or etCmp(jonx.getroot(), jon.getroot()):
+        fail(f"Edited verse 3 of Jonah gives changed chapters {changed}")
+
+def test_hashmoves():
+    import os
+    from usfmtc.usxmodel import ethash
+    fname = os.path.join(os.path.dirname(__file__), "32JONBSB.usfm")
+    jon = usfmtc.readFile(fname)
+    root = jon.getroot()
+    paras = [e for e in root if e.tag == "para" and len(e)]
+    a, b = paras[0], paras[1]
+    c = a[-1]
+    a.remove(c)
+    b.append(c)
+    if c.parent is not b:
+        fail("Moved element does not have its new parent")
+    before = ethash(root)
+    c.tail = (c.tail or "") + " moved"
+    after = ethash(root)
+    if after == before or after != ethash(usfmtc.readFile(jon.outUsx(None), informat="usx").getroot()):
+        fail("Editing a moved element does not change the document hash")
+    b.tag = "table"
+    if ethash(root) == after:
+        fail("Renaming an element does not change the document hash")
+    d = b[0]
+    b.remove(d)
+    a.insert(0, d)
+    e = a[-1]
+    a.remove(e)
+    b.extend([e])
+    if d.parent is not a or e.parent is not b:
+        fail("Inserted and extended elements do not have their new parents")
+    for x in (d, e):
+        before = ethash(root)
+        x.tail = (x.tail or "") + " moved"
+        if ethash(root) == before:
+            fail(f"Editing moved {x} does not change the document hash")
+
+def test_usjstream():
+    import os, io
+    from usfmtc.usjproc import writeusj
+    jon = usfmtc.readFile(os.path.join(os.path.dirname(__file__), "32JONBSB.usfm"))
+    usj = jon.outUsj(None)
+    for indent, seps in ((2, None), (None, (",", ":"))):
+        outf = io.StringIO()
+        writeusj(outf, jon.getroot(), indent=indent, bufsize=100)
+        if outf.getvalue() != json.dumps(usj, indent=indent, ensure_ascii=False, separators=seps):
+            fail(f"Streamed USJ with {indent=} differs from usxtousj")
+    outf = io.StringIO()
+    jon.outUsj(outf, compact=True)
+    if json.loads(outf.getvalue()) != usj:
+        fail("Compact USJ does not load back the same")
+
+def test_usfmtousj():
+    import os, io
+    from usfmtc.usjproc import usfmtousj
+    fname = os.path.join(os.path.dirname(__file__), "32JONBSB.usfm")
+    for canonical in (False, True):
+        jon = usfmtc.readFile(fname, canonical=canonical)
+        outf = io.StringIO()
+        usfmtousj(outf, fname, canonical=canonical, bufsize=100)
+        if outf.getvalue() != json.dumps(jon.outUsj(None), indent=2, ensure_ascii=False):
+            fail(f"Direct USFM to USJ with {canonical=} differs from outUsj")
+        jonj = usfmtc.readFile(outf.getvalue(), informat="usj")
+        if not etCmp(jon.getroot(), jonj.getroot()):
+            fail(f"Direct USFM to USJ with {canonical=} does not read back the same")
+
+def test_usjread():
+    import os, io
+    from usfmtc.usjproc import readusj, usjtousx
+    jon = usfmtc.readFile(os.path.join(os.path.dirname(__file__), "32JONBSB.usfm"))
+    usj = json.dumps(jon.outUsj(None), indent=2)
+    for bufsize in (7, 65536):
+        for inf in (io.StringIO(usj), io.BytesIO(usj.encode("utf-8"))):
+            root = readusj(inf, bufsize=bufsize, pure=True)
+            if not etCmp(root, usjtousx(json.loads(usj))):
+                fail(f"Streamed USJ read with {bufsize=} differs from usjtousx")
+    depth = 5000
+    deep = '{"type": "USJ", "content": [' + '{"type": "char", "marker": "w", "content": ["x", ' * depth \
+                + '"y"' + ']}' * depth + ']}'
+    root = readusj(io.StringIO(deep), pure=True)
+    for i in range(depth):
+        root = root[0]
+    if root.tag != "char" or len(root):
+        fail("Deeply nested USJ read wrongly")
+    with pytest.raises(ValueError):
+        readusj(io.StringIO('{"type": "USJ", "content": [}'), pure=True)
+
+def test_usfmemitter():
+    import os, io
+    from usfmtc.usfmgenerate import usx2usfm, Emitter
+    jon = usfmtc.readFile(os.path.join(os.path.dirname(__file__), "32JONBSB.usfm"))
+    outf = io.StringIO()
+    lastel, cref = usx2usfm(outf, jon.getroot(), jon.grammar)
+    if str(cref) != "JON 4:11":
+        fail(f"Last verse of Jonah is {cref}")
+    small = io.StringIO()
+    usx2usfm(small, jon.getroot(), jon.grammar, emitter=lambda *a, **kw: Emitter(*a, bufsize=10, **kw))
+    if small.getvalue() != outf.getvalue():
+        fail("USFM output differs with a small buffer")
+    usfm = r"""\id JHN escapes
+\c 1
+\p
+\v 1 a\|b \\ c \// d\~e f~g
+"""
+    doc, f = _dousfm(usfm)
+    if r"a\|b \\ c \// d\~e f~g" not in f:
+        fail(f"Bad character escaping in {f}")
+
+def test_keepsource():
+    import os
+    fname = os.path.join(os.path.dirname(__file__), "32JONBSB.usfm")
+    with open(fname, encoding="utf-8") as inf:
+        src = inf.read()
+    jon = usfmtc.readFile(fname, keepsource=True)
+    if jon.outUsfm(None) != src:
+        fail("Unchanged Jonah is not output as its source")
+    for v in jon.getroot().iter("verse"):
+        if v.get("number") == "3" and v.tail and "Jonah" in v.tail:
+            v.tail = v.tail.replace("Jonah", "Jonas")
+            break
+    f = jon.outUsfm(None)
+    changed = [l for l in f.splitlines() if l not in src.splitlines()]
+    if len(changed) != 1 or "Jonas" not in changed[0]:
+        fail(f"Edited Jonah changes lines {changed}")
+    if not etCmp(usfmtc.readFile(f, informat="usfm").getroot(), jon.getroot()):
+        fail("Edited Jonah does not read back the same")
+    if jon.outUsfm(None, version=[3, 1]) != jon.outUsfm(None, source=None):
+        fail("Jonah output with a given version is copied from its source")
+    jon = usfmtc.readFile(fname, keepsource=True)
+    paras = [e for e in jon.getroot() if e.tag == "para" and e.get("style") == "q1"]
+    paras[0].set("style", "q2")
+    paras[1].attrib["style"] = "q2"
+    paras[2].tag = "table"
+    paras[2].tag = "para"
+    paras[2].attrib = dict(paras[2].attrib, style="q2")
+    f = jon.outUsfm(None)
+    if f.count("\\q2") != src.count("\\q2") + 3 or f.count("\\q1") != src.count("\\q1") - 3:
+        fail("Renamed markers in Jonah are copied from its source")
+    jon = usfmtc.readFile(fname, keepsource=True)
+    p = [e for e in jon.getroot() if e.tag == "para" and e.get("style") == "p"][1]
+    e = et.SubElement(p, "char", {"style": "bd"})
+    e.text = "Added"
+    if "\\bd Added\\bd*" not in jon.outUsfm(None):
+        fail("A paragraph added to by SubElement is copied from its source")
+
+def test_saveall(tmp_path):
+    import os, io
+    fname = os.path.join(os.path.dirname(__file__), "32JONBSB.usfm")
+    jon = usfmtc.readFile(fname, keepsource=True)
+    jon.addesids()
+    usj = json.dumps(jon.outUsj(None), indent=2, ensure_ascii=False)
+    usfm = jon.outUsfm(None)
+    usx = jon.copy(deep=True).outUsx(None)
+    outs = {str(tmp_path / "jon.usx"): None, str(tmp_path / "jon.json"): None, str(tmp_path / "jon.out"): "usfm"}
+    jon.saveAll(outs)
+    for p, e in zip(outs, (usx, usj, usfm)):
+        with open(p, encoding="utf-8") as inf:
+            if inf.read() != e:
+                fail(f"{p} from saveAll differs from its output on its own")
+    if jon.outUsj(None) != json.loads(usj):
+        fail("saveAll changed the document")
+    compact = io.StringIO()
+    jon.saveAll({compact: "usj"}, compact=True)
+    if json.loads(compact.getvalue()) != json.loads(usj) or "\n" in compact.getvalue():
+        fail("Compact USJ from saveAll differs")
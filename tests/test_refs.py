@@ -598,3 +598,182 @@ def test_subset2():
         fail(f"ms1 missing from {f}")
 
 
+
+def test_verse_text():
+    res = jon_usfm.gettext(Ref("JON 2:1"))
+    if "saying" in res:
+        fail(f"Text of following verse included. Got '{res}'")
+    # copy_text stops at the start of the end verse, not after it
+    verses = []
+    for e in jon_usfm.getroot().iter():
+        if e.tag == "chapter" and e.get("number"):
+            c = e.get("number")
+        elif e.tag == "verse" and e.get("number"):
+            verses.append(f"JON {c}:{e.get('number')}")
+    for a, b in zip(verses, verses[1:]):
+        res = jon_usfm.gettext(Ref(a))
+        nxt = jon_usfm.gettext(Ref(b)).strip()[:20]
+        if not res.strip() or nxt in res:
+            fail(f"Text of {a} includes {b}. Got '{res}'")
+
+def test_textindex():
+    doc = jon_usfm.copy(deep=True)
+    refs = [Ref(s) for s in ("JON 1:1", "JON 1:17", "JON 2", "JON 1:3-5", "JON 1:1-2:3", "JON 4:11", "JON 2:8!2-4")]
+    expected = [doc.gettext(r) for r in refs]
+    doc.buildtextindex()
+    for r, e in zip(refs, expected):
+        res = doc.gettext(r)
+        if res != e:
+            fail(f"Indexed text of {r} is '{res}' not '{e}'")
+    doc.getroot().find(".//verse[@number='3']").tail = "Changed text."
+    res = doc.gettext(Ref("JON 1:3"))
+    if not res.startswith("Changed text."):
+        fail(f"Text index not updated after change. Got '{res}'")
+
+def test_rangeview():
+    refs = list(RefList("JON 1:4-8; 4:9-11"))
+    root = jon_usfm.getroot()
+    h = jon_usfm.contenthash()
+    doc = jon_usfm.getrefs(*refs, titles=False)
+    view = jon_usfm.getrefs(*refs, titles=False, view=True)
+    for fmt in ("outUsfm", "outUsx"):
+        if getattr(doc, fmt)(None) != getattr(view, fmt)(None):
+            fail(f"View {fmt} differs from copy")
+    if not any(e.parent is root for e in view.getroot()):
+        fail("View copied all its elements")
+    if jon_usfm.contenthash() != h or any(e.parent is not root for e in root):
+        fail("Making a view changed the original")
+    newdoc = view.materialize()
+    if any(e.parent is root for e in newdoc.getroot()):
+        fail("Materialized view shares elements with the original")
+    for fn in (view.canonicalise, view.addesids, lambda: view.saveAs("view.usx", addesids=True)):
+        try:
+            fn()
+        except ValueError:
+            continue
+        fail("A view was changed")
+    newdoc.canonicalise()
+    newdoc.addesids()
+    if jon_usfm.contenthash() != h:
+        fail("Changing a view changed the original")
+
+def test_parsecache():
+    from usfmtc.reference import enable_parsecache, disable_parsecache, parsecache_stats
+    enable_parsecache(maxsize=2)
+    try:
+        for s in ("JHN 3:16", "JHN 3:16-18", "JHN 3:16", "JHN 3:16-18"):
+            r = Ref(s)
+            if str(r) != s:
+                fail(f"Cached parse of {s} gave {r}")
+            r.last.verse = 20       # changing a result must not change the cache
+        rl = RefList("ROM 3:23; 6:23")
+        rl = RefList("ROM 3:23; 6:23")
+        if str(rl) != "ROM 3:23; 6:23":
+            fail(f"Cached parse of reference list gave {rl}")
+        stats = parsecache_stats()
+        if stats["hits"] != 3 or stats["size"] != 2:
+            fail(f"Unexpected cache statistics {stats}")
+    finally:
+        disable_parsecache()
+
+def test_sortkey():
+    strs = ["GEN 1:1", "GEN 1:2", "GEN 1:2a", "GEN 1:2b", "GEN 1:10", "GEN 2", "GEN 2:1", "EXO 1:1", "MAT 1:1", "REV 22:21"]
+    refs = [Ref(s) for s in strs]
+    res = [str(r) for r in sorted(reversed(refs), key=lambda r: r.sortkey())]
+    if res != strs:
+        fail(f"Bad sort order {res}")
+    upper = Ref("GEN 1:2A")
+    if not Ref("GEN 1:2").sortkey() < upper.sortkey() < Ref("GEN 1:2b").sortkey():
+        fail(f"Upper case subverse sorts at {upper.sortkey()}")
+    if hasattr(refs[0], "__dict__"):
+        fail("Ref instances have a __dict__")
+    if len(set(refs + [Ref("GEN 1:1")])) != len(refs):
+        fail("Equal references do not hash the same")
+
+def test_refset():
+    from usfmtc.refset import RefSet
+    a = RefSet("GEN 1:1-10; GEN 1:5-20; EXO 2; JHN 3:16")
+    b = RefSet("GEN 1:15-2:3; JHN 3")
+    tests = [(a, "GEN 1:1-20; EXO 2:1-25; JHN 3:16"),
+             (a | b, "GEN 1:1-2:3; EXO 2:1-25; JHN 3:1-36"),
+             (a & b, "GEN 1:15-20; JHN 3:16"),
+             (a - b, "GEN 1:1-14; EXO 2:1-25"),
+             (a ^ b, "GEN 1:1-14,21-2:3; EXO 2:1-25; JHN 3:1-15,17-36")]
+    for i, (r, s) in enumerate(tests):
+        if str(r) != s:
+            fail(f"RefSet test {i} gave {r} instead of {s}")
+    if len(a) != 46:
+        fail(f"RefSet has {len(a)} verses, not 46")
+    if not a.contains(Ref("EXO 2:4-6")) or a.contains(RefList("GEN 1:3-21")):
+        fail("RefSet contains failed")
+    if not a.overlaps(Ref("JHN 3")) or a.overlaps(Ref("JHN 4")):
+        fail("RefSet overlaps failed")
+    if str(RefSet("GEN 50:20-EXO 1:3").toRefList()) != "GEN 50:20-EXO 1:3":
+        fail("RefSet across books failed")
+
+def test_simplifyoverlap():
+    _listtest("JDG 15:13-16:23; JDG 15:2-18; 2SA 23-24; 2SA 23:25", "JDG 15:2-16:23; 2SA 23-24")
+    _listtest("GEN 1:5-10; GEN 1; GEN 2:1", "GEN 1-2:1")
+
+def test_simplifycontained():
+    # verses and ranges within a later chapter or chapter range
+    _listtest("GEN 2:3; GEN 2", "GEN 2")
+    _listtest("EXO 1:7-14; EXO 1", "EXO 1")
+    _listtest("GEN 4:2; GEN 4-6", "GEN 4-6")
+    _listtest("GEN 4:16; GEN 4-5", "GEN 4-5")
+    _listtest("GEN 3:19; GEN 1-3", "GEN 1-3")
+    _listtest("GEN 3-4; GEN 3:3", "GEN 3-4")
+    # overlapping chapter ranges
+    _listtest("EXO 2; EXO 1-2", "EXO 1-2")
+    _listtest("EXO 3-4; EXO 1-3", "EXO 1-4")
+
+def test_simplifyloading():
+    # simplify is called while the default versification is being loaded
+    old = Ref._defvrs
+    Ref._defvrs = "Loading"
+    try:
+        _listtest("GEN 1:5-10; GEN 1; GEN 2:1", "GEN 1-2:1")
+    finally:
+        Ref._defvrs = old
+
+def test_parse_many():
+    lines = ["  GEN 1:1; 3:4-6\n", "JHN 3:16, 18", "not a ref at all!", "ROM 3:23-6:23 "]
+    res = RefList.parse_many(lines, skiperrors=True)
+    strs = [None if r is None else str(r) for r in res]
+    if strs != ["GEN 1:1; 3:4-6", "JHN 3:16,18", None, "ROM 3:23-6:23"]:
+        fail(f"parse_many gave {strs}")
+    longs = "; ".join(f"MAT {c}:{v}" for c in range(1, 29) for v in (1, 5, 9))
+    if len(RefList(longs)) != 28 * 3:
+        fail(f"Long reference list parsed to {len(RefList(longs))} refs")
+
+def test_findrefs():
+    text = "See Genesis 1:1-3; 2:4 and The First Book of Samuel 3:4, not Genesisx 1:1 nor Exodus alone, but Jude 5."
+    res = [(text[m.start:m.end], str(m.refs)) for m in bkenv.findrefs(text)]
+    if res != [("Genesis 1:1-3; 2:4", "GEN 1:1-3; 2:4"), ("The First Book of Samuel 3:4", "1SA 3:4"), ("Jude 5", "JUD 5")]:
+        fail(f"Found references {res}")
+    from usfmtc.refscan import RefScanner
+    text = "A man 3 times, Man 4 and job 5 went; see MAN 3 and JOB 5:2."
+    res = [(text[m.start:m.end], str(m.refs)) for m in RefScanner().finditer(text)]
+    if res != [("MAN 3", "MAN 3"), ("JOB 5:2", "JOB 5:2")]:
+        fail(f"Book codes not in upper case found as references {res}")
+
+def test_ordinals():
+    r = Ref("MAT 5:3")
+    o = r.ordinal()
+    if str(Ref.fromordinal(o)) != "MAT 5:3" or Ref("MAT 1:1").distance(r) != o - Ref("MAT 1:1").ordinal():
+        fail(f"Bad ordinal {o} for {r}")
+    rr = RefList("RUT 4:20-22")[0]
+    if rr.numverses() != 3 or [str(x) for x in RefRange(Ref("RUT 4:21"), Ref("1SA 1:1"))] != ["RUT 4:21", "RUT 4:22", "1SA 1:1"]:
+        fail(f"Bad range arithmetic over {rr}")
+    ords = Ref.versification.getordinals()
+    res = ords.ordinals(["GEN", "MAT"], [1, 5], [1, 3])
+    if list(res) != [0, o] or list(ords.valid(["GEN", "GEN", "XXA"], [50, 51, 1], [26, 1, 1])) != [True, False, False]:
+        fail(f"Bad bulk ordinals {list(res)}")
+
+def test_bulkverses():
+    rl = RefList("GEN 1:30-2:2; MAT 5:3b; JUD 3-4")
+    if len(rl.ordinals()) != 7 or [str(r) for r in rl.allverses()][:5] != ["GEN 1:30", "GEN 1:31", "GEN 2:1", "GEN 2:2", "MAT 5:3"]:
+        fail(f"Bad verse expansion of {rl}")
+    rl = RefList([Ref("GEN 50:26"), Ref(book="GEN", chapter=51, verse=1), Ref("JUD 1:30"), RefList("RUT 1:1-4:22")[0]])
+    if list(rl.validmask()) != [True, False, False, True]:
+        fail(f"Bad bulk validation {list(rl.validmask())}")
@@ -2,9 +2,9 @@ import pytest
 from pytest import fail
 from usfmtc import readFile
 from usfmtc.reference import Ref
-from usfmtc.versification import Versification, cached_versification
+from usfmtc.versification import Versification, cached_versification, cached_pair
 from usfmtc.usxmodel import etCmp
-import os
+import os, usfmtc
 
 engvrs = cached_versification("eng")
 jon_usfm = readFile(os.path.join(os.path.dirname(__file__), "32JONBSB.usfm"))
@@ -185,3 +185,68 @@ according unto the multitude of thy tender mercies blot out my transgressions.
 \q1 \v 4 \vp 2\vp* Wash me throughly from mine iniquity, and cleanse me from my sin.
 '''
     cmptest(intext, outtext, 'PSA', 51, 'Reversification', keep=True)
+
+def test_pairmatch():
+    orgvrs = cached_versification("org")
+    for tgt in (None, orgvrs):
+        vpair = cached_pair(engvrs, tgt)
+        for k in list(engvrs.toorg) + list(engvrs.fromorg) + ["GEN 1:1", "ESG 1:1"]:
+            r = Ref(k)
+            for rev in (False, True):
+                exp = engvrs.remap(r, tgt, reverse=rev)
+                res = vpair.remap(r, reverse=rev)
+                if str(res) != str(exp):
+                    fail(f"{r} pair remaps to {res} instead of {exp} ({tgt=}, {rev=})")
+
+def test_compiled(tmp_path, monkeypatch):
+    fpath = os.path.join(os.path.dirname(usfmtc.__file__), "eng.vrs")
+    src = Versification(fpath, compiled=False)
+    cpath = str(tmp_path / "eng.vrsc")
+    if src.writeCompiled(fpath, outpath=cpath) is None:
+        fail("Failed to write compiled eng.vrs")
+    res = Versification()
+    if not res.readCompiled(fpath, inpath=cpath):
+        fail("Failed to read compiled eng.vrs")
+    if res.vnums != src.vnums or res.name != src.name:
+        fail("Compiled verse counts differ from eng.vrs")
+    for a in ("toorg", "fromorg"):
+        if {k: str(v) for k, v in getattr(res, a).items()} != {k: str(v) for k, v in getattr(src, a).items()}:
+            fail(f"Compiled {a} mappings differ from eng.vrs")
+    from usfmtc.versification import compiled_path
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    before = sorted(os.listdir(os.path.dirname(fpath)))
+    Versification(fpath)
+    if not os.path.exists(compiled_path(fpath)) or not compiled_path(fpath).startswith(str(tmp_path / "cache")):
+        fail(f"Compiled eng.vrs is not in the user cache but {compiled_path(fpath)}")
+    if sorted(os.listdir(os.path.dirname(fpath))) != before:
+        fail("Compiling eng.vrs wrote beside it")
+
+def _runmain(monkeypatch, *args):
+    from usfmtc.versification import main
+    monkeypatch.setattr("sys.argv", ["usfmreversify"] + [str(a) for a in args])
+    main()
+
+def test_mainjobs(tmp_path, monkeypatch, capsys):
+    indir = tmp_path / "in"
+    indir.mkdir()
+    with open(os.path.join(os.path.dirname(__file__), "32JONBSB.usfm"), encoding="utf-8") as inf:
+        (indir / "32JON.usfm").write_text(inf.read(), encoding="utf-8")
+    (indir / "23ISA.usfm").write_text("\\id ISA Test book\n\\c 9\n\\p\n\\v 1 One\n\\v 2 Two\n\\v 21 Last\n", encoding="utf-8")
+    engpath = os.path.join(os.path.dirname(usfmtc.__file__), "eng.vrs")
+    outs = []
+    for j in (1, 2):
+        outdir = tmp_path / f"out{j}"
+        outdir.mkdir()
+        _runmain(monkeypatch, "-f", engpath, "-j", j, "-o", outdir, indir)
+        outs.append({f: (outdir / f).read_text(encoding="utf-8") for f in sorted(os.listdir(outdir))})
+    if len(outs[0]) != 2 or outs[0] != outs[1]:
+        fail(f"Reversifying with -j 2 gives {list(outs[1])} not as with -j 1 {list(outs[0])}")
+    (indir / "01GEN.usfm").mkdir()      # unreadable as a book
+    outdir = tmp_path / "outbad"
+    outdir.mkdir()
+    capsys.readouterr()
+    with pytest.raises(SystemExit):
+        _runmain(monkeypatch, "-f", engpath, "-j", 2, "-o", outdir, indir)
+    res = capsys.readouterr().out
+    if "1 of 3 books failed" not in res or "01GEN.usfm" not in res or sorted(os.listdir(outdir)) != list(outs[0]):
+        fail(f"A failing book is not reported or stops the others: {res}")